@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Build step that decodes every texture in data/assets.json into a single bundle file
+# The game memory-maps the bundle and creates Surfaces straight from it, instead of decoding each image at startup (see gamesystem.common.bundle)
+# Card and playspace textures are stored already clipped to their rects. Textures whose draw size depends on the screen are stored whole and shrunk when loaded
+import json
+import os
+
+import pygame
+
+from context import gamesystem
+from gamesystem.common.bundle import write_bundle
+from gamesystem.common.assets import fit_surface
+from gmods import BlueprintsStorageModule
+from consts import BUNDLE_PATH
+
+
+def build_bundle(filename=BUNDLE_PATH):
+	with open("data/assets.json") as file:
+		textures = json.load(file)["textures"]
+
+	blueprints = BlueprintsStorageModule(None)
+	with open("data/blueprints.json") as file:
+		blueprints.create(json.load(file))
+	fits = blueprints.texture_fits()
+
+	surfaces = {}
+	for name, path in textures.items():
+		surf = pygame.image.load(path)
+		fit = fits.get(name)
+		surfaces[name] = (path, surf if fit is None else fit_surface(surf, *fit), fit)
+
+	write_bundle(filename, surfaces)
+	return len(textures)
+
+
+if __name__ == "__main__":
+	count = build_bundle()
+	print(f"Wrote {count} textures to {BUNDLE_PATH} ({os.path.getsize(BUNDLE_PATH) // 1024} KiB)")
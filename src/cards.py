@@ -4,7 +4,6 @@ from particles import particle_explosion, SurfaceParticle, DeflatingParticle
 import json
 import fonts
 from playspaces import Playspace
-from tooltip import Tooltip
 import logging
 import copy
 
@@ -13,10 +12,16 @@ import copy
 class DespawningCard(Sprite):
 	LAYER = "PARTICLE"
 
+	SHRINK = 0.98  # Scale lost every frame
+	SCALE_STEP = 0.05  # The texture is drawn at the scale rounded to this, so the animation only ever needs a handful of cached sizes
+
 	def __init__(self, pos: Vector2, texture: Surface, vel: Vector2 = Vector2(0, -2), lifetime: int = 20):
 		self.pos = pos
 		self.vel = vel
-		self.texture = texture
+		# The texture is always scaled from the original Surface, which is never drawn onto, so cards of the same kind share the scaled Surfaces
+		self._source = texture
+		self._scale = 1.0
+		self.texture = game.transforms.scale_by(self._source, self._scale)
 		self._lifetime = lifetime
 		self._opacity = 255
 		self._decay = self._opacity / lifetime
@@ -27,22 +32,27 @@ class DespawningCard(Sprite):
 	# Create from an existing card
 	@classmethod
 	def from_card(cls, card, **kwargs):
-		return cls(card.rect.topleft, card._surf.copy(), **kwargs)
+		return cls(card.rect.topleft, card._surf, **kwargs)
 
 	# Move upward and reduce opacity
 	def update_move(self):
-		self.texture = pygame.transform.scale_by(self.texture, (0.98, 0.98))
+		self._scale *= DespawningCard.SHRINK
+		step = DespawningCard.SCALE_STEP
+		self.texture = game.transforms.scale_by(self._source, max(step, round(self._scale / step) * step))
 
 		self._opacity -= self._decay
 
 		if self._opacity < 1:
 			self.destroy()
 
-	# Blit to screen
+	# Blit to screen. The scaled texture is shared, so its alpha is set every time right before it is drawn
 	def update_draw(self):
 		self.texture.set_alpha(int(self._opacity))
 		game.windowsystem.screen.blit(self.texture, self._easing(255 - self._opacity))
 
+	def draw_state(self):
+		return (FRect(self._easing(255 - self._opacity), self.texture.get_size()), self._opacity)
+
 
 # Variant of DespawningCard that moves off to the side of the screen
 class PollutingCard(DespawningCard):
@@ -56,6 +66,7 @@ class PollutingCard(DespawningCard):
 		return cls(card.rect.topleft, target, card._surf, **kwargs)
 
 	def update_draw(self):
+		self.texture.set_alpha(255)
 		game.windowsystem.screen.blit(self.texture, self._easing(255 - self._opacity))
 
 
@@ -88,8 +99,12 @@ class Card(Sprite):
 		self.held_frames = 0  # How many frames card has been held for
 		self.data = data
 
-		clipped = game.textclip.get_or_insert(texture, self.rect.size)
-		self._setup_surfaces(clipped)
+		# Every card of the same kind shares the same face and shadow Surfaces
+		self._surf, self._shadow_surf = game.prerender.get_or_render(
+			("card", data.play_id, int(self.rect.width), int(self.rect.height)),
+			texture,
+			lambda: self._render_surfaces(game.textclip.get_or_insert(texture, self.rect.size))
+		)
 
 	# Generate card from a json blueprint
 	@classmethod
@@ -100,36 +115,32 @@ class Card(Sprite):
 
 	# Spawn a tooltip that tracks the card
 	def with_tooltip(self):
-		game.sprites.new(Tooltip(self.data.title, self.data.description, self.rect, parent=self))
+		game.tooltips.new(self.data.title, self.data.description, self.rect, parent=self)
 		return self
 
 	# Create the card's image and its shadow
-	def _setup_surfaces(self, texture: Surface):
-		self._surf = Surface(self.rect.size, pygame.SRCALPHA)
-		self._shadow_surf = self._surf.copy()
-
+	def _render_surfaces(self, texture: Surface) -> Tuple[Surface, Surface]:
 		r = self.rect.copy()
 		r.topleft = VZERO  # type: ignore
 
-		self._surf.blit(texture, VZERO)
-		self._surf = surface_rounded_corners(texture, 5)
+		surf = surface_rounded_corners(texture, 5)
 
-		pygame.draw.rect(self._surf, palette.BLACK, r, border_radius=5, width=10)
+		pygame.draw.rect(surf, palette.BLACK, r, border_radius=5, width=10)
 
 		heading_bg = r.inflate(-30, -r.height * 0.85)
 		heading_bg.y = 0
 
-		pygame.draw.rect(self._surf, palette.GREY, r.inflate(-10, -10), border_radius=5, width=2)
-		pygame.draw.rect(self._surf, palette.BLACK, heading_bg, border_radius=10)
+		pygame.draw.rect(surf, palette.GREY, r.inflate(-10, -10), border_radius=5, width=2)
+		pygame.draw.rect(surf, palette.BLACK, heading_bg, border_radius=10)
 
-		title_surf = fonts.families.roboto.size(18).render(self.data.title, True, palette.WHITE)
-		self._surf.blit(title_surf, heading_bg.center - Vector2(title_surf.get_size()) / 2)
+		title_surf = fonts.families.roboto.render(self.data.title, 18, True, palette.WHITE)
+		surf.blit(title_surf, heading_bg.center - Vector2(title_surf.get_size()) / 2)
 
-		self._shadow_surf = shadow_from_rect(self._surf.get_rect(), border_radius=5)
+		return surf, shadow_from_rect(surf.get_rect(), border_radius=5)
 
 	# Check if card is colliding with any playspaces (buildings) and return the first collision. Returns none if not
 	def playspace_collide(self) -> Optional[Playspace]:
-		for playspace in game.sprites.get("PLAYSPACE"):
+		for playspace in game.spatial.query("PLAYSPACE", self.rect):
 			if playspace.collidecard(self):
 				return playspace
 
@@ -145,7 +156,11 @@ class Card(Sprite):
 
 	# Check if the card is currently hovering over a playspace
 	def is_hovered(self) -> bool:
-		return any(space.card_hovering_exclude(self) for space in game.sprites.get("PLAYSPACE"))
+		return game.spatial.any("PLAYSPACE", self.hover_rect())
+
+	# The region of the card that has to overlap a playspace for the card to be hovering it
+	def hover_rect(self) -> FRect:
+		return self.rect.inflate(-Card.PLAYABLE_OVERLAP, -Card.PLAYABLE_OVERLAP)
 
 	# Check if the mouse is currently hovering over a card
 	def mouse_over_me(self) -> bool:
@@ -236,6 +251,11 @@ class Card(Sprite):
 		target = target if target else Vector2(game.windowsystem.rect.topright)
 		game.sprites.new(PollutingCard.from_card(self, target=target, **kwargs))
 
+	def draw_state(self):
+		shadow = min(Card.SHADOW_OFFSET, self.held_frames)
+		region = self.rect.union(self.rect.move(shadow, shadow)) if shadow else self.rect
+		return (region, (shadow, self.z))
+
 	# Render the card to the screen
 	def update_draw(self):
 		if self.held_frames:
@@ -247,43 +267,52 @@ class Card(Sprite):
 
 
 # Class for encapsulating all cards currently in the scene
+# Keeps a table of CardReps indexed by card, and lays out every card's target position once per frame in update_move
 class Hand(Sprite):
 	LAYER = "MANAGER"
 	CARD_SPACING = 20
 
-	# Dataclass representing a card and its index in the row of cards in hand
+	# Dataclass representing a card, its index in the row of cards in hand, and where it should glide to
 	@dataclass
 	class CardRep:
 		card: Card
 		idx: int
+		slot: Optional[Vector2] = None  # Position the card aligns its bottomleft to, computed by Hand.layout
+		playable: bool = False  # If the card would be played if dropped now, computed once per frame
 
 	def __init__(self, rect):
 		self.rect = rect
 		self.currently_dragged = None
-		self.card_map = []
+		self.card_map = []  # CardReps ordered by idx
+		self._reps = {}  # Card -> CardRep
 
 	# Check if Card is contained in CardRef list
 	def contains(self, card):
-		return self.get_card_rep(card) is not None
+		return card in self._reps
 
 	# Update internals
 	def update_move(self):
-		cglobal = game.sprites.get("CARD")
 		# Add new cards to the hand's registry if they were not previously there
-		for card in cglobal:
-			if self.get_card_rep(card) is None:
-				self.card_map.append(Hand.CardRep(card, len(self.card_map) - 1))
+		for card in game.sprites.iterate("CARD"):
+			if card not in self._reps:
+				rep = Hand.CardRep(card, len(self.card_map) - 1)
+				self._reps[card] = rep
+				self.card_map.append(rep)
 
-		self.card_map = [ref for ref in self.card_map if not ref.card.is_destroyed()]
+		if any(ref.card.is_destroyed() for ref in self.card_map):
+			self.card_map = [ref for ref in self.card_map if not ref.card.is_destroyed()]
+			self._reps = {ref.card: ref for ref in self.card_map}
 
 		idxs = [ref.idx for ref in self.card_map]
 		# Sort cards based on their x position
 		self.card_map.sort(key=lambda ref: ref.card.rect.x)
 
+		for ref in self.card_map:
+			ref.playable = ref.card.is_playable()
+
 		# If the indexes have changed then play a sound of cards being shuffled over each other
-		if self.currently_dragged is not None and not self.currently_dragged.is_playable() and idxs != [
-			ref.idx for ref in self.card_map
-		]:
+		dragged = self._reps.get(self.currently_dragged)
+		if dragged is not None and not dragged.playable and idxs != [ref.idx for ref in self.card_map]:
 			game.audio.sounds.card_switch.play()
 
 		for i, ref in enumerate(self.card_map):
@@ -294,30 +323,31 @@ class Hand(Sprite):
 		if self.currently_dragged:
 			self.currently_dragged.z = 2
 
+		self.layout()
 
-	# Get the position at which a card SHOULD try to align itself
-	def get_position_from_card(self, card) -> Optional[Vector2]:
-		total_width = sum(
-			ref.card.rect.width + Hand.CARD_SPACING if not ref.card.is_playable() else 0 for ref in self.card_map
-		)
+	# Compute the target position of every card in one pass. Cards that would be played if dropped do not take up space in the row
+	def layout(self):
+		row = [ref for ref in self.card_map if not ref.playable]
+		total_width = sum(ref.card.rect.width + Hand.CARD_SPACING for ref in row)
 
-		start_pos = self.rect.midbottom - Vector2(total_width / 2, 0)
-		for ref in sorted(self.card_map, key=lambda ref: ref.idx):
-			if card is ref.card:
-				return start_pos
-			if not ref.card.is_playable():
-				start_pos += Vector2(card.rect.width + Hand.CARD_SPACING, 0)
+		x, y = self.rect.midbottom
+		x -= total_width / 2
+		for ref in self.card_map:
+			ref.slot = Vector2(x, y)
+			if not ref.playable:
+				x += ref.card.rect.width + Hand.CARD_SPACING
 
-		return None
+	# Get the position at which a card SHOULD try to align itself
+	def get_position_from_card(self, card) -> Optional[Vector2]:
+		rep = self._reps.get(card)
+		if rep is None or rep.slot is None:
+			return None
+		return Vector2(rep.slot)
 
 	# Get the card alignment position, given a CardRef
 	def get_position_from_ref(self, ref) -> Optional[Vector2]:
 		return self.get_position_from_card(ref.card)
 
-
 	# Get the corresponding CardRep given a Card
 	def get_card_rep(self, card):
-		for rep in self.card_map:
-			if rep.card is card:
-				return rep
-		return None
+		return self._reps.get(card)
@@ -9,6 +9,7 @@ TOOLTIP_HOVER_TIME = 40
 POLLUTION_UNPLAYED_INCR = 0.1
 MAX_INVESMENTS = 10
 SERVER_ADDRESS = "http://localhost:5000"
+BUNDLE_PATH = "data/textures.bundle"  # Pre-decoded textures written by build_bundle.py
 
 
 __all__ = ["VZERO", "CARD_RECT", "HAND_SIZE"]
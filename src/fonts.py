@@ -1,9 +1,11 @@
 import json
+from collections import OrderedDict
 from types import SimpleNamespace
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, Callable
 from dataclasses import dataclass
 
 import pygame.font
+from pygame import Surface, Color
 from pygame.font import Font
 
 # Init fonts
@@ -13,6 +15,64 @@ pygame.font.init()
 NONE_FONT = pygame.font.Font(None, 28)
 
 
+# Least recently used cache of rendered text Surfaces, limited by the total size of the Surfaces in bytes
+# Cached Surfaces are shared between everything that renders the same text, so they must not be drawn onto
+class RenderCache:
+
+	def __init__(self, budget: int = 16 * 1024 * 1024):
+		self.budget = budget
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries: OrderedDict[Tuple, Surface] = OrderedDict()
+
+	# Get a Surface from the cache, or create it with render and store it
+	def get_or_render(self, key: Tuple, render: Callable[[], Surface]) -> Surface:
+		surf = self._entries.get(key)
+		if surf is not None:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return surf
+
+		self.misses += 1
+		surf = render()
+		size = surf.get_pitch() * surf.get_height()
+
+		# Surfaces bigger than the whole budget are returned without being cached
+		if size > self.budget:
+			return surf
+
+		self._entries[key] = surf
+		self.bytes += size
+		while self.bytes > self.budget:
+			_, old = self._entries.popitem(last=False)
+			self.bytes -= old.get_pitch() * old.get_height()
+			self.evictions += 1
+
+		return surf
+
+	def clear(self):
+		self._entries.clear()
+		self.bytes = 0
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			"entries": len(self._entries),
+			"bytes": self.bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+	def __len__(self):
+		return len(self._entries)
+
+
+# Shared by every FontFamily
+render_cache = RenderCache()
+
+
 # Class representing a font family and all of the different sizes availible
 @dataclass
 class FontFamily:
@@ -33,6 +93,17 @@ class FontFamily:
 
 		return self.sizes[x]
 
+	# Render text at a size, reusing the Surface from an earlier identical render if it is still cached
+	# The returned Surface is shared and must not be modified
+	def render(
+		self, text: str, size: int, antialias: bool, colour, background=None, wraplength: int = 0
+	) -> Surface:
+		key = (
+			self.path, text, size, antialias, tuple(Color(colour)),
+			tuple(Color(background)) if background is not None else None, wraplength
+		)
+		return render_cache.get_or_render(key, lambda: self.size(size).render(text, antialias, colour, background, wraplength))
+
 
 # Load fonts defined in data/assets.json
 with open("data/assets.json") as file:
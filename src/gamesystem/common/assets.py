@@ -1,9 +1,42 @@
+import pygame.transform
 from pygame import Surface, SRCALPHA, Rect
 from typing import List, Tuple
 
 import random
 
-__all__ = ["SpriteSheet"]
+__all__ = ["SpriteSheet", "fit_surface", "FIT_MODES"]
+
+FIT_MODES = ("crop", "stretch", "fit")
+
+
+def fit_surface(surface: Surface, mode: str, size: Tuple[int, int]) -> Surface:
+	"""Shrink a Surface to the largest size it is drawn at. Surfaces already within size are returned unchanged
+
+	"crop" keeps only the top-left region of size, for textures that are clipped when drawn.
+	"stretch" smoothscales each side down to size independently, for textures stretched to a size when drawn.
+	"fit" smoothscales down keeping the aspect ratio until the Surface fits within size, for textures scaled uniformly when drawn
+	"""
+	width, height = surface.get_size()
+	if width <= size[0] and height <= size[1]:
+		return surface
+
+	if mode == "crop":
+		return surface.subsurface(Rect(0, 0, min(width, size[0]), min(height, size[1]))).copy()
+
+	if mode == "stretch":
+		target = (min(width, size[0]), min(height, size[1]))
+	elif mode == "fit":
+		ratio = min(size[0] / width, size[1] / height)
+		target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+	else:
+		raise ValueError(f"Unknown fit mode {mode}, expected one of {FIT_MODES}")
+
+	# smoothscale only works on 24 and 32 bit Surfaces
+	if surface.get_bitsize() < 24:
+		full = Surface(surface.get_size(), SRCALPHA, 32)
+		full.blit(surface, (0, 0))
+		surface = full
+	return pygame.transform.smoothscale(surface, target)
 
 
 class SpriteSheet():
@@ -80,3 +113,16 @@ def test_UNIT_spritesheet_creation():
 	src.fill((0, 0, 0))
 
 	sheet = SpriteSheet(src, Dimensions(500, 100), ["hehe", "haha"])
+
+
+def test_UNIT_fit_surface():
+	src = Surface((400, 200), SRCALPHA, 32)
+	src.fill((255, 0, 0, 255), Rect(0, 0, 10, 10))
+
+	assert fit_surface(src, "crop", (500, 500)) is src
+	cropped = fit_surface(src, "crop", (10, 300))
+	assert cropped.get_size() == (10, 200)
+	assert cropped.get_at((5, 5)) == (255, 0, 0, 255)
+
+	assert fit_surface(src, "stretch", (100, 100)).get_size() == (100, 100)
+	assert fit_surface(src, "fit", (1000, 100)).get_size() == (200, 100)
@@ -0,0 +1,176 @@
+import pygame.image
+from pygame import Surface
+
+import json
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+__all__ = ["BundleEntry", "TextureBundle", "write_bundle"]
+
+MAGIC = b"TWBUNDLE"
+VERSION = 2
+ALIGN = 16
+
+# Magic, version, length of the json index
+_HEADER = struct.Struct("<8sII")
+
+
+Fit = Optional[Tuple[str, Tuple[int, int]]]
+
+
+def _source_stat(path: str) -> Optional[Tuple[int, int]]:
+	"""Get the modification time in nanoseconds and the size in bytes of a source image, or None if it does not exist"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return (stat.st_mtime_ns, stat.st_size)
+
+
+def _fit_fields(fit: Fit) -> Optional[List]:
+	"""Get a fit as it is stored in the json index"""
+	return None if fit is None else [fit[0], [int(fit[1][0]), int(fit[1][1])]]
+
+
+@dataclass(slots=True, frozen=True)
+class BundleEntry:
+	path: str  # Source image the pixels were decoded from
+	offset: int
+	width: int
+	height: int
+	mtime_ns: Optional[int]  # Modification time of the source image when the bundle was built
+	source_size: Optional[int]  # Size in bytes of the source image when the bundle was built
+	fit: Optional[List]  # (mode, size) the pixels were shrunk to (see gamesystem.common.assets.fit_surface), or None if they are whole
+
+	@property
+	def nbytes(self) -> int:
+		return self.width * self.height * 4
+
+	def matches(self, path: str, fit: Fit = None) -> bool:
+		"""Are the pixels still what decoding path and shrinking it to fit would give
+
+		The source must be the same file, unchanged since the bundle was built. Whole pixels match any fit, as it can still be applied to them.
+		If the source image no longer exists the pixels are trusted, as there is nothing to decode instead
+		"""
+		if path != self.path:
+			return False
+		if self.fit is not None and self.fit != _fit_fields(fit):
+			return False
+
+		stat = _source_stat(path)
+		return stat is None or stat == (self.mtime_ns, self.source_size)
+
+
+def _aligned(n: int) -> int:
+	return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_bundle(filename: str, textures: Dict[str, Tuple[str, Surface, Fit]]):
+	"""Write already decoded textures to a bundle file as raw RGBA pixels
+
+	textures maps a texture name to the path it was loaded from, its Surface, and the fit it was shrunk to or None.
+	The modification time and size of each source image are recorded, so stale entries can be told apart (see BundleEntry.matches).
+	The file is a fixed header, a json index of name -> BundleEntry fields, then the pixel data of each texture at an aligned offset
+	"""
+	index = {}
+	blobs = []
+	offset = 0
+	for name, (path, surf, fit) in textures.items():
+		data = pygame.image.tobytes(surf, "RGBA")
+		mtime_ns, source_size = _source_stat(path) or (None, None)
+		index[name] = {
+			"path": path,
+			"offset": offset,
+			"width": surf.get_width(),
+			"height": surf.get_height(),
+			"mtime_ns": mtime_ns,
+			"source_size": source_size,
+			"fit": _fit_fields(fit),
+		}
+		blobs.append(data)
+		offset = _aligned(offset + len(data))
+
+	index_bytes = json.dumps(index).encode()
+	data_start = _aligned(_HEADER.size + len(index_bytes))
+
+	with open(filename, "wb") as file:
+		file.write(_HEADER.pack(MAGIC, VERSION, len(index_bytes)))
+		file.write(index_bytes)
+		file.write(bytes(data_start - file.tell()))
+		for data in blobs:
+			file.write(data)
+			file.write(bytes(_aligned(len(data)) - len(data)))
+
+
+class TextureBundle():
+	"""Read-only, memory-mapped bundle of decoded textures written by write_bundle
+
+	Surfaces are created straight from the mapped pixels, so loading a texture does no image decoding.
+	The Surfaces returned by surface share memory with the mapping and must be copied (e.g. with convert_alpha) before being drawn onto
+	"""
+
+	def __init__(self, filename: str):
+		self._file = open(filename, "rb")
+		self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, index_length = _HEADER.unpack_from(self._map)
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise ValueError(f"{filename} is not a version {VERSION} texture bundle")
+
+		index = json.loads(self._map[_HEADER.size:_HEADER.size + index_length])
+		self._data_start = _aligned(_HEADER.size + index_length)
+		self.entries: Dict[str, BundleEntry] = {name: BundleEntry(**fields) for name, fields in index.items()}
+
+	def surface(self, name: str) -> Surface:
+		entry = self.entries[name]
+		start = self._data_start + entry.offset
+		return pygame.image.frombuffer(memoryview(self._map)[start:start + entry.nbytes], (entry.width, entry.height), "RGBA")
+
+	def close(self):
+		self._map.close()
+		self._file.close()
+
+	def __contains__(self, name) -> bool:
+		return name in self.entries
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.entries)
+
+
+def test_UNIT_texturebundle():
+	import os
+	import tempfile
+
+	a = Surface((3, 2), pygame.SRCALPHA)
+	a.fill((10, 20, 30, 40))
+	b = Surface((5, 7), pygame.SRCALPHA)
+	b.fill((1, 2, 3, 255))
+
+	fd, filename = tempfile.mkstemp()
+	os.close(fd)
+	fd, source = tempfile.mkstemp(suffix=".png")
+	os.close(fd)
+	try:
+		pygame.image.save(b, source)
+		write_bundle(filename, {"a": ("a.png", a, None), "b": (source, b, ("crop", (5, 7)))})
+		bundle = TextureBundle(filename)
+		assert bundle.entries["a"].path == "a.png"
+		assert bundle.surface("a").get_at((2, 1)) == (10, 20, 30, 40)
+		assert bundle.surface("b").get_size() == (5, 7)
+
+		assert bundle.entries["a"].matches("a.png", ("stretch", (10, 10)))
+		assert bundle.entries["b"].matches(source, ("crop", (5, 7)))
+		assert not bundle.entries["b"].matches(source, ("crop", (4, 7)))
+		assert not bundle.entries["b"].matches("other.png", ("crop", (5, 7)))
+
+		# Editing the source makes the entry stale
+		pygame.image.save(Surface((6, 6)), source)
+		assert not bundle.entries["b"].matches(source, ("crop", (5, 7)))
+		bundle.close()
+	finally:
+		os.remove(filename)
+		os.remove(source)
@@ -0,0 +1,17 @@
+from pygame import Rect
+from .sprite import Sprite
+
+import math
+
+__all__ = ["bounding_rect", "draws"]
+
+
+def bounding_rect(rect) -> Rect:
+	"""Integer Rect that fully covers a (possibly fractional) rect, with a small margin for antialiasing and borders"""
+	x, y = math.floor(rect[0]), math.floor(rect[1])
+	return Rect(x - 2, y - 2, math.ceil(rect[0] + rect[2]) - x + 4, math.ceil(rect[1] + rect[3]) - y + 4)
+
+
+def draws(sprite) -> bool:
+	"""Does the sprite draw anything, i.e. does it have an update_draw of its own"""
+	return type(sprite).update_draw is not Sprite.update_draw or "update_draw" in sprite.__dict__
@@ -0,0 +1,148 @@
+from pygame import Rect, FRect
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+__all__ = ["SpatialHash"]
+
+
+class SpatialHash():
+	"""Uniform grid that buckets objects with a rect attribute into square cells
+
+	Queries only look at the cells covered by the query rect, so their cost depends on how crowded that area is rather than on the total number of objects.
+	Results are returned in insertion order so callers that depend on "first match" behaviour keep working
+	"""
+
+	class _Entry():
+		__slots__ = ["seq", "cells", "key"]
+
+		def __init__(self, seq, cells, key):
+			self.seq = seq
+			self.cells = cells
+			self.key = key
+
+	def __init__(self, cell_size: int = 256):
+		self.cell_size = cell_size
+		self._cells: Dict[Tuple[int, int], Dict[Any, None]] = {}
+		self._entries: Dict[Any, SpatialHash._Entry] = {}
+		self._seq = 0
+
+	@staticmethod
+	def _rect_key(rect: Union[Rect, FRect]) -> Tuple[float, float, float, float]:
+		return (rect.x, rect.y, rect.width, rect.height)
+
+	def _cell_range(self, rect: Union[Rect, FRect]) -> Tuple[int, int, int, int]:
+		cs = self.cell_size
+		return (int(rect.left // cs), int(rect.top // cs), int(rect.right // cs), int(rect.bottom // cs))
+
+	def _iter_cells(self, cells: Tuple[int, int, int, int]) -> Iterator[Tuple[int, int]]:
+		x0, y0, x1, y1 = cells
+		for y in range(y0, y1 + 1):
+			for x in range(x0, x1 + 1):
+				yield (x, y)
+
+	def _place(self, obj, cells):
+		for c in self._iter_cells(cells):
+			bucket = self._cells.get(c)
+			if bucket is None:
+				bucket = self._cells[c] = {}
+			bucket[obj] = None
+
+	def _unplace(self, obj, cells):
+		for c in self._iter_cells(cells):
+			bucket = self._cells.get(c)
+			if bucket is None:
+				continue
+			bucket.pop(obj, None)
+			if not bucket:
+				del self._cells[c]
+
+	def insert(self, obj):
+		"""Add an object to the grid. Objects already present are updated instead"""
+		if obj in self._entries:
+			self.update(obj)
+			return
+
+		cells = self._cell_range(obj.rect)
+		self._entries[obj] = SpatialHash._Entry(self._seq, cells, self._rect_key(obj.rect))
+		self._seq += 1
+		self._place(obj, cells)
+
+	def remove(self, obj):
+		"""Remove an object from the grid if it is present"""
+		entry = self._entries.pop(obj, None)
+		if entry is not None:
+			self._unplace(obj, entry.cells)
+
+	def update(self, obj) -> bool:
+		"""Move an object to the cells covered by its current rect. Returns True if the rect had changed"""
+		entry = self._entries[obj]
+		key = self._rect_key(obj.rect)
+		if key == entry.key:
+			return False
+
+		entry.key = key
+		cells = self._cell_range(obj.rect)
+		if cells != entry.cells:
+			self._unplace(obj, entry.cells)
+			self._place(obj, cells)
+			entry.cells = cells
+		return True
+
+	def clear(self):
+		self._cells = {}
+		self._entries = {}
+
+	def candidates(self, rect: Union[Rect, FRect]) -> List[Any]:
+		"""Return every object sharing a cell with rect, without an exact collision test"""
+		found = {}
+		for c in self._iter_cells(self._cell_range(rect)):
+			bucket = self._cells.get(c)
+			if bucket:
+				found.update(bucket)
+
+		if len(found) < 2:
+			return list(found)
+		return sorted(found, key=lambda obj: self._entries[obj].seq)
+
+	def query(self, rect: Union[Rect, FRect]) -> List[Any]:
+		"""Return every object whose rect collides with the given rect, in insertion order"""
+		return [obj for obj in self.candidates(rect) if obj.rect.colliderect(rect)]
+
+	def query_point(self, point) -> List[Any]:
+		"""Return every object whose rect contains the given point, in insertion order"""
+		cs = self.cell_size
+		bucket = self._cells.get((int(point[0] // cs), int(point[1] // cs)))
+		if not bucket:
+			return []
+		return sorted((obj for obj in bucket if obj.rect.collidepoint(point)), key=lambda obj: self._entries[obj].seq)
+
+	def __contains__(self, obj) -> bool:
+		return obj in self._entries
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def __iter__(self):
+		return iter(list(self._entries))
+
+
+def test_UNIT_spatialhash_query():
+
+	class Box():
+
+		def __init__(self, *args):
+			self.rect = FRect(*args)
+
+	grid = SpatialHash(100)
+	a, b, c = Box(0, 0, 50, 50), Box(40, 40, 300, 30), Box(500, 500, 10, 10)
+	for box in (a, b, c):
+		grid.insert(box)
+
+	assert grid.query(FRect(45, 45, 1, 1)) == [a, b]
+	assert grid.query(FRect(200, 45, 1, 1)) == [b]
+
+	c.rect.topleft = (10, 10)
+	grid.update(c)
+	assert grid.query(FRect(0, 0, 20, 20)) == [a, c]
+
+	grid.remove(a)
+	assert grid.query_point((15, 15)) == [c]
@@ -1,6 +1,19 @@
 class Sprite():
 	_destroyed = False
-	z = 0
+	_z = 0
+	_layer = None  # The SpriteLayer that owns the sprite, set by the SpritesManager
+
+	@property
+	def z(self):
+		return self._z
+
+	@z.setter
+	def z(self, value):
+		"""Set the draw order of the sprite and notify the owning layer if it actually changed"""
+		if value != self._z:
+			self._z = value
+			if self._layer is not None:
+				self._layer._notify_z(self)
 
 	def update_move(self):
 		pass
@@ -8,8 +21,21 @@ class Sprite():
 	def update_draw(self):
 		pass
 
+	def draw_state(self):
+		"""Describe what the sprite is about to draw, for window systems running in dirty rect mode
+
+		Return (region, appearance) where region is the rect the sprite draws within and appearance is a hashable, immutable value that changes whenever the sprite would look different.
+		Returning None means the whole screen is redrawn while the sprite is alive
+		"""
+		return None
+
 	def destroy(self):
+		if self._destroyed:
+			return
+
 		self._destroyed = True
+		if self._layer is not None:
+			self._layer._notify_destroyed(self)
 
 	def is_destroyed(self):
 		return self._destroyed
@@ -1,9 +1,15 @@
 from .modulebase import GameModule
-from typing import Dict
+from ..common.bundle import TextureBundle
+from ..common.assets import fit_surface
+from typing import Dict, Iterable, Optional, Set, Tuple
 import pygame.image
 from pygame import Surface
 from dataclasses import dataclass
+from collections import deque
+import itertools
+import threading
 import logging
+import os
 
 
 @dataclass(slots=True, frozen=True)
@@ -12,32 +18,362 @@ class AssetEntry:
 	img: Surface
 
 
+class AssetHandle():
+	"""Reference to a texture that may still be decoding in the background. surface() blocks until it is ready"""
+
+	__slots__ = ["name", "_manager"]
+
+	def __init__(self, name, manager):
+		self.name = name
+		self._manager = manager
+
+	def ready(self) -> bool:
+		return self._manager.is_loaded(self.name)
+
+	def surface(self) -> Surface:
+		return self._manager.get(self.name)
+
+
 # TODO: Investigate wrong asset being used randomly
 class AssetManager(GameModule):
+	"""GameModule for loading textures
+
+	By default every texture is loaded when the module is created. With lazy=True textures are instead decoded by background threads in the order given,
+	and a texture is only waited for when it is first accessed (as an attribute, or through get). prefetch moves textures to the front of the queue.
+	Accessing a texture that no thread has started on yet loads it immediately on the calling thread.
+	Surfaces are always converted with convert_alpha on the thread that accesses them, since conversion needs the display
+
+	Residency is reference counted per scope (such as a scene). acquire holds textures for a scope, release lets them go, and textures no scope holds are evicted by evict_unused.
+	Evicted textures are loaded again if they are accessed later. With preload=False nothing is loaded until it is acquired, prefetched or accessed
+
+	If a texture bundle file (see gamesystem.common.bundle) is given and exists, textures in it are created from its memory-mapped pixels instead of being decoded.
+	Bundle entries built from a different path, from a source image that has changed since, or shrunk to a different fit than the texture's are ignored
+
+	fit maps texture names to the (mode, size) they are shrunk to when decoded (see gamesystem.common.assets.fit_surface), so textures are only as large
+	as they are ever drawn. This happens on the decoding thread, before conversion
+	"""
+
 	IDMARKER = "assets"
 
-	def create(self, assets: Dict[str, str]):
+	def create(
+		self,
+		assets: Dict[str, str],
+		lazy: bool = False,
+		workers: int = 2,
+		preload: bool = True,
+		bundle: Optional[str] = None,
+		fit: Optional[Dict[str, Tuple[str, Tuple[int, int]]]] = None
+	):
 		self._assets = {}
-		for pair in assets.items():
-			self._load(*pair)
+		self._paths = {}
+		self._lazy = lazy
+		self._fit = dict(fit or {})
+
+		self._bundle = None
+		if bundle is not None and os.path.exists(bundle):
+			try:
+				self._bundle = TextureBundle(bundle)
+			except (OSError, ValueError) as e:
+				logging.warning(f"Could not open texture bundle {bundle}: {e}")
+
+		self._refs: Dict[str, int] = {}  # Texture name -> number of scopes holding it
+		self._scopes: Dict[str, Set[str]] = {}  # Scope -> texture names it holds
+		self._scene = None
+
+		self._cond = threading.Condition()
+		self._queue = deque()  # Names waiting for a worker
+		self._loading = set()  # Names a worker is decoding
+		self._decoded = {}  # Names decoded by a worker but not converted yet, to a Surface or the exception raised
+		self._discard = set()  # Names evicted while a worker was decoding them, whose result is dropped
 
-	def _load(self, name, path):
-		if name in self.__dict__:
+		for name, path in assets.items():
+			self._register(name, path)
+
+		if lazy:
+			if preload:
+				self._queue.extend(assets.keys())
+			for i in range(workers):
+				threading.Thread(target=self._worker, name=f"AssetManager-{i}", daemon=True).start()
+		elif preload:
+			for name in assets.keys():
+				self._resolve(name)
+
+	def _register(self, name, path):
+		if name in self.__dict__ or name in self._paths:
 			raise TypeError(f"{name} already present")
+		self._paths[name] = path
+
+	def _worker(self):
+		while True:
+			with self._cond:
+				while not self._queue:
+					self._cond.wait()
+				name = self._queue.popleft()
+				self._loading.add(name)
+
+			try:
+				result = self._decode(name)
+			except Exception as e:
+				result = e
+
+			with self._cond:
+				self._loading.discard(name)
+				if name in self._discard:
+					self._discard.discard(name)
+				else:
+					self._decoded[name] = result
+				self._cond.notify_all()
+
+	def _decode(self, name) -> Surface:
+		"""Get the unconverted Surface for a texture, from the bundle if it is in there and up to date, shrunk to its fit"""
+		path = self._paths[name]
+		fit = self._fit.get(name)
+		surf = None
+		if self._bundle is not None:
+			entry = self._bundle.entries.get(name)
+			if entry is not None and entry.matches(path, fit):
+				surf = self._bundle.surface(name)
+			elif entry is not None:
+				logging.warning(f"Bundled {name} is out of date with {path} or its fit, decoding it instead")
+		if surf is None:
+			surf = pygame.image.load(path)
+
+		return surf if fit is None else fit_surface(surf, *fit)
 
-		img = pygame.image.load(path).convert_alpha()
+	def _resolve(self, name) -> Surface:
+		"""Finish loading a texture, waiting for or taking over its decode if needed"""
+		with self._cond:
+			if name in self.__dict__:
+				return self.__dict__[name]
+
+			if name in self._queue:
+				self._queue.remove(name)
+				result = None
+			else:
+				while name in self._loading:
+					self._cond.wait()
+				result = self._decoded.pop(name, None)
+
+		path = self._paths[name]
+		if result is None:
+			result = self._decode(name)
+		elif isinstance(result, Exception):
+			raise result
+
+		img = result.convert_alpha()
 		self.__dict__[name] = img
 		self._assets[name] = AssetEntry(path, img)
 		logging.debug(f"Loaded {name} = {img} from path: {path}")
+		return img
+
+	def __getattr__(self, name):
+		# Only called for textures that have not been resolved yet (and for genuinely missing attributes)
+		paths = self.__dict__.get("_paths")
+		if paths is None or name not in paths:
+			raise AttributeError(name)
+		return self._resolve(name)
+
+	def prefetch(self, *names):
+		"""Hint that textures will be needed soon, so they are decoded before anything else still queued
+
+		Does nothing unless lazy, as otherwise textures are loaded as soon as they are acquired or accessed
+		"""
+		if not self._lazy:
+			return
+
+		with self._cond:
+			for name in reversed(names):
+				self._discard.discard(name)
+				if name in self._queue:
+					self._queue.remove(name)
+				elif name in self.__dict__ or name in self._loading or name in self._decoded:
+					continue
+				self._queue.appendleft(name)
+			self._cond.notify_all()
+
+	def acquire(self, scope: str, names: Iterable[str]):
+		"""Hold textures for a scope so they are not evicted, and start loading any that are not resident"""
+		held = self._scopes.setdefault(scope, set())
+		new = [name for name in dict.fromkeys(names) if name not in held]
+		for name in new:
+			if name not in self._paths:
+				raise KeyError(name)
+			held.add(name)
+			self._refs[name] = self._refs.get(name, 0) + 1
+
+		if self._lazy:
+			self.prefetch(*new)
+		else:
+			for name in new:
+				self.get(name)
+
+	def release(self, scope: str):
+		"""Let go of every texture a scope holds. They stay resident until evict_unused"""
+		for name in self._scopes.pop(scope, ()):
+			self._refs[name] -= 1
+			if not self._refs[name]:
+				del self._refs[name]
+
+	def enter_scene(self, scene: str, names: Iterable[str]):
+		"""Switch the current scene's textures to names, and evict every texture no scope holds any more
+
+		The new textures are acquired before the previous scene's are released, so textures the scenes share are not reloaded
+		"""
+		previous = self._scene
+		self._scene = scene
+		self.acquire(scene, names)
+		if previous is not None and previous != scene:
+			self.release(previous)
+		self.evict_unused()
+
+	def evict(self, name):
+		"""Drop a loaded texture. Sprites still using the Surface keep it alive, and accessing it through the AssetManager loads it again"""
+		with self._cond:
+			self._decoded.pop(name, None)
+			if name in self._queue:
+				self._queue.remove(name)
+			if name in self._loading:
+				self._discard.add(name)
+		self.__dict__.pop(name, None)
+		if self._assets.pop(name, None) is not None:
+			logging.debug(f"Evicted {name}")
+
+	def evict_unused(self):
+		"""Evict every resident texture that no scope holds, including ones decoded in the background that were never accessed
+		and ones still being decoded, whose result is dropped when the decode finishes
+		"""
+		with self._cond:
+			decoded = [name for name in itertools.chain(self._decoded, self._loading) if name not in self._refs]
+		for name in [name for name in self._assets if name not in self._refs] + decoded:
+			self.evict(name)
+
+	def _decoded_surfaces(self) -> Dict[str, Surface]:
+		"""Get the textures decoded in the background that have not been accessed yet"""
+		with self._cond:
+			return {name: surf for name, surf in self._decoded.items() if isinstance(surf, Surface)}
+
+	def refcount(self, name) -> int:
+		return self._refs.get(name, 0)
+
+	def resident_bytes(self) -> int:
+		"""Get the total size in bytes of every loaded texture, and of every decoded texture that is waiting to be accessed"""
+		surfaces = itertools.chain((entry.img for entry in self._assets.values()), self._decoded_surfaces().values())
+		return sum(surf.get_pitch() * surf.get_height() for surf in surfaces)
+
+	def residency(self) -> Dict[str, Dict[str, int]]:
+		"""Get the reference count and size in bytes of every loaded or decoded texture"""
+		surfaces = {**self._decoded_surfaces(), **{name: entry.img for name, entry in self._assets.items()}}
+		return {
+			name: {"refs": self.refcount(name), "bytes": surf.get_pitch() * surf.get_height()}
+			for name, surf in surfaces.items()
+		}
+
+	def is_loaded(self, name) -> bool:
+		return name in self.__dict__
 
 	def add(self, name, path):
-		self._load(name, path)
+		self._register(name, path)
+		self._resolve(name)
 
 	def get(self, name) -> Surface:
-		return self.__dict__[name]
+		return self.__dict__[name] if name in self.__dict__ else self._resolve(name)
+
+	def handle(self, name) -> AssetHandle:
+		"""Get a handle to a texture without waiting for it to load"""
+		if name not in self._paths:
+			raise KeyError(name)
+		return AssetHandle(name, self)
 
 	def get_entry(self, name) -> AssetEntry:
+		self.get(name)
 		return self._assets[name]
 
 	def all(self) -> Dict[str, AssetEntry]:
+		"""Get the AssetEntry of every loaded texture"""
 		return self._assets
+
+
+def test_UNIT_assetmanager_evicts_prefetched():
+	import os
+	import tempfile
+
+	directory = tempfile.mkdtemp()
+	paths = {}
+	for name, size in [("a", (4, 4)), ("b", (8, 2))]:
+		paths[name] = os.path.join(directory, f"{name}.png")
+		pygame.image.save(Surface(size), paths[name])
+
+	pygame.display.init()
+	pygame.display.set_mode((1, 1))
+	try:
+		assets = AssetManager(None)
+		assets.create(paths, lazy=True, workers=1, preload=False)
+		assets.acquire("scene", ["a", "b"])
+		with assets._cond:
+			while len(assets._decoded) < 2:
+				assets._cond.wait()
+		assert assets.resident_bytes() == sum(surf.get_pitch() * surf.get_height() for surf in assets._decoded.values())
+		assert set(assets.residency()) == {"a", "b"}
+
+		# Decoded but never accessed, then let go of by the scope
+		assets.release("scene")
+		assets.evict_unused()
+		assert not assets._decoded
+		assert assets.resident_bytes() == 0
+		assert assets.get("a").get_size() == (4, 4)
+	finally:
+		for path in paths.values():
+			os.remove(path)
+		os.rmdir(directory)
+
+
+def test_UNIT_assetmanager_evicts_loading():
+	import os
+	import tempfile
+
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, "a.png")
+	pygame.image.save(Surface((4, 4)), path)
+
+	pygame.display.init()
+	pygame.display.set_mode((1, 1))
+	try:
+		assets = AssetManager(None)
+		assets.create({"a": path}, lazy=True, workers=1, preload=False)
+		started, gate = threading.Event(), [threading.Event()]
+		decode = assets._decode
+		assets._decode = lambda name: (started.set(), gate[0].wait(), decode(name))[2]
+
+		def decoding():
+			started.wait()
+			started.clear()
+
+		def decoded():
+			with assets._cond:
+				while "a" in assets._loading:
+					assets._cond.wait()
+
+		# Let go of by the scope while the worker is still decoding it
+		assets.acquire("scene", ["a"])
+		decoding()
+		assets.release("scene")
+		assets.evict_unused()
+		gate[0].set()
+		decoded()
+		assert not assets._decoded and not assets._discard
+		assert assets.resident_bytes() == 0
+
+		# Acquired again before the decode finishes, so the result is kept
+		gate[0] = threading.Event()
+		assets.acquire("scene", ["a"])
+		decoding()
+		assets.release("scene")
+		assets.evict_unused()
+		assets.acquire("scene", ["a"])
+		gate[0].set()
+		decoded()
+		assert set(assets._decoded) == {"a"}
+		assert assets.get("a").get_size() == (4, 4)
+	finally:
+		os.remove(path)
+		os.rmdir(directory)
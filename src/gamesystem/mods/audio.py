@@ -2,9 +2,11 @@ from .modulebase import GameModule
 import pygame.mixer
 from pygame.mixer import Sound, Channel
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from types import SimpleNamespace
-from typing import Dict
+from typing import Dict, List, Optional
+import logging
+import random
 
 
 class AudioManagerNumChannels(GameModule):
@@ -35,3 +37,214 @@ class AudioManagerNumChannels(GameModule):
 			loaded[key] = af
 
 		return SimpleNamespace(**loaded)
+
+
+@dataclass(slots=True)
+class SoundSettings:
+	priority: int = 0  # Voices can only be stolen by sounds of the same or a higher priority
+	max_voices: int = 4  # Most voices the sound can play on at once. Past this its oldest voice is restarted
+	coalesce_ms: int = 0  # Plays this soon after the last one are dropped, so bursts of the same sound play once. 0 turns this off
+	volume: float = 1.0
+
+
+@dataclass(slots=True)
+class Voice:
+	name: str
+	priority: int
+	started: int  # pygame.time.get_ticks() when the voice started
+
+
+class VoicePoolAudioManager(GameModule):
+	"""GameModule that plays sounds on a fixed pool of voices (mixer channels)
+
+	Each sound has SoundSettings limiting how many voices it can use and how often it can start. When every voice is busy,
+	the oldest voice playing a sound of the lowest priority at or below the new sound's is stolen, and if there is none the new sound is dropped.
+	Sounds are only decoded the first time they are played (or preloaded).
+	Music tracks are streamed from disk through pygame.mixer.music rather than decoded into memory, and can be played in order as a playlist.
+	update must be called every tick for the playlist to advance
+	"""
+
+	IDMARKER = "audio"
+
+	@dataclass(slots=True, frozen=True)
+	class AudioFile:
+		path: str
+		name: str
+		idx: int
+		manager: "VoicePoolAudioManager" = field(repr=False)
+
+		def play(self):
+			self.manager.play(self.name)
+
+	def create(
+		self,
+		sounds: Dict[str, str],
+		num_voices: int = 16,
+		settings: Optional[Dict[str, SoundSettings]] = None,
+		music: Optional[Dict[str, str]] = None
+	):
+		pygame.mixer.init()
+		pygame.mixer.set_num_channels(num_voices)
+		self.num_voices = num_voices
+
+		self._paths = dict(sounds)
+		self._settings = {name: (settings or {}).get(name, SoundSettings()) for name in sounds}
+		self._decoded: Dict[str, Sound] = {}
+		self._voices: Dict[int, Voice] = {}  # Channel index -> what it is playing
+		self._last_played: Dict[str, int] = {}
+
+		self.plays = 0
+		self.coalesced = 0
+		self.stolen = 0
+		self.dropped = 0
+
+		self.sounds = SimpleNamespace(
+			**{key: VoicePoolAudioManager.AudioFile(path=path, name=key, idx=i, manager=self) for i, (key, path) in enumerate(sounds.items())}
+		)
+
+		self._music = dict(music or {})
+		self._playlist: List[str] = []
+		self._playlist_idx = 0
+		self._playlist_shuffle = False
+		self._playlist_active = False
+
+	def _sound(self, name) -> Sound:
+		sound = self._decoded.get(name)
+		if sound is None:
+			sound = self._decoded[name] = Sound(self._paths[name])
+			sound.set_volume(self._settings[name].volume)
+		return sound
+
+	def preload(self, *names):
+		"""Decode sounds now instead of the first time they are played"""
+		for name in names:
+			self._sound(name)
+
+	def _prune(self):
+		for idx in [idx for idx in self._voices if not Channel(idx).get_busy()]:
+			del self._voices[idx]
+
+	def _free_channel(self, priority: int) -> Optional[int]:
+		for idx in range(self.num_voices):
+			if idx not in self._voices:
+				return idx
+
+		candidates = [(voice.priority, voice.started, idx) for idx, voice in self._voices.items() if voice.priority <= priority]
+		if not candidates:
+			return None
+		self.stolen += 1
+		return min(candidates)[2]
+
+	def play(self, name: str):
+		settings = self._settings[name]
+		now = pygame.time.get_ticks()
+
+		last = self._last_played.get(name)
+		if last is not None and now - last < settings.coalesce_ms:
+			self.coalesced += 1
+			return
+		self._last_played[name] = now
+
+		self._prune()
+		own = sorted((voice.started, idx) for idx, voice in self._voices.items() if voice.name == name)
+		if len(own) >= settings.max_voices:
+			idx = own[0][1]
+		else:
+			idx = self._free_channel(settings.priority)
+			if idx is None:
+				self.dropped += 1
+				return
+
+		Channel(idx).play(self._sound(name))
+		self._voices[idx] = Voice(name, settings.priority, now)
+		self.plays += 1
+
+	def play_music(self, name: str, loops: int = 0, fade_ms: int = 0):
+		"""Stream a music track, replacing whatever music is playing. Stops the playlist"""
+		self._playlist_active = False
+		self._start_music(name, loops, fade_ms)
+
+	def _start_music(self, name: str, loops: int = 0, fade_ms: int = 0):
+		try:
+			pygame.mixer.music.load(self._music[name])
+			pygame.mixer.music.play(loops, fade_ms=fade_ms)
+		except pygame.error as e:
+			# Stop the playlist too, rather than retrying the next track every tick
+			logging.warning(f"Could not play music {name}: {e}")
+			self._playlist_active = False
+
+	def set_playlist(self, names: List[str], shuffle: bool = False):
+		"""Play music tracks one after another, looping over the list. With shuffle the order is reshuffled every time through"""
+		self._playlist = list(names)
+		self._playlist_shuffle = shuffle
+		self._playlist_idx = 0
+		self._playlist_active = bool(self._playlist)
+		if shuffle:
+			random.shuffle(self._playlist)
+		if self._playlist:
+			self._start_music(self._playlist[0])
+
+	def stop_music(self, fade_ms: int = 0):
+		self._playlist_active = False
+		if fade_ms:
+			pygame.mixer.music.fadeout(fade_ms)
+		else:
+			pygame.mixer.music.stop()
+
+	def update(self):
+		if self._playlist_active and not pygame.mixer.music.get_busy():
+			self._playlist_idx += 1
+			if self._playlist_idx >= len(self._playlist):
+				self._playlist_idx = 0
+				if self._playlist_shuffle:
+					random.shuffle(self._playlist)
+			self._start_music(self._playlist[self._playlist_idx])
+
+	def stats(self) -> Dict[str, int]:
+		self._prune()
+		return {
+			"voices": len(self._voices),
+			"decoded": len(self._decoded),
+			"plays": self.plays,
+			"coalesced": self.coalesced,
+			"stolen": self.stolen,
+			"dropped": self.dropped,
+		}
+
+
+class NullAudioManager(GameModule):
+	"""Drop-in replacement for AudioManagerNumChannels that never touches the mixer. Sounds are not decoded and play does nothing
+
+	Used when running headless, where there may be no audio device
+	"""
+
+	IDMARKER = "audio"
+
+	@dataclass(slots=True, frozen=True)
+	class AudioFile:
+		path: str
+		name: str
+		idx: int
+
+		def play(self):
+			pass
+
+	def create(self, sounds: Dict[str, str], **kwargs):
+		self.sounds = SimpleNamespace(
+			**{key: NullAudioManager.AudioFile(path=path, name=key, idx=i) for i, (key, path) in enumerate(sounds.items())}
+		)
+
+	def preload(self, *names):
+		pass
+
+	def play_music(self, name: str, loops: int = 0, fade_ms: int = 0):
+		pass
+
+	def set_playlist(self, names: List[str], shuffle: bool = False):
+		pass
+
+	def stop_music(self, fade_ms: int = 0):
+		pass
+
+	def update(self):
+		pass
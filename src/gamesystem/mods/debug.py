@@ -1,6 +1,7 @@
 from .modulebase import GameModule
+import pygame.draw
 import pygame.font
-from pygame import Color
+from pygame import Color, Surface
 
 
 class DebugOverlayManager(GameModule):
@@ -17,9 +18,16 @@ class DebugOverlayManager(GameModule):
 
 		self._font = pygame.font.Font(font, self._fontsize) if type(font) is str or font is None else font
 		self._queue = []
+		self._graphs = []
 		self._logs = []
+		self._drawn = False
 
 	def update(self):
+		# In dirty rect mode the overlay has to be presented in full when text is drawn, and once more to erase it
+		if self._queue or self._graphs or self._drawn:
+			self.game.windowsystem.mark_all_dirty()
+		self._drawn = bool(self._queue or self._graphs)
+
 		x = self._fontsize * 0.5
 		for i, txt in enumerate(self._queue):
 			y = (i + 0.5) * self._fontsize * 1.5
@@ -27,5 +35,32 @@ class DebugOverlayManager(GameModule):
 			self.game.windowsystem.uscreen.blit(rendered, (x, y))
 		self._queue = []
 
+		y = self.game.windowsystem.uscreen.get_height()
+		for values, max_value, size, marker in self._graphs:
+			y -= size[1] + self._fontsize * 0.5
+			self.game.windowsystem.uscreen.blit(self._render_graph(values, max_value, size, marker), (x, y))
+		self._graphs = []
+
+	def _render_graph(self, values, max_value, size, marker) -> Surface:
+		w, h = size
+		surf = Surface(size, pygame.SRCALPHA)
+		surf.fill((0, 0, 0, 160))
+
+		step = w / max(len(values), 1)
+		for i, v in enumerate(values):
+			bar = min(v / max_value, 1.0) * h
+			px = i * step
+			pygame.draw.line(surf, self._fontcolour, (px, h), (px, h - bar))
+
+		if marker is not None:
+			my = h - min(marker / max_value, 1.0) * h
+			pygame.draw.line(surf, Color(255, 255, 255), (0, my), (w, my))
+
+		return surf
+
 	def output(self, txt):
 		self._queue.append(str(txt))
+
+	def graph(self, values, max_value: float, size=(300, 100), marker=None):
+		"""Draw a bar graph of values in the bottom left corner this frame. Bars are scaled so max_value is full height, and marker draws a horizontal line at that value"""
+		self._graphs.append((values, max_value, size, marker))
@@ -34,40 +34,102 @@ class StateManager(GameModule):
 
 		self.deltatime = 0
 		self.time_now = time.time()
+		self.sim_time = 0.0
 
 	def timer(self, length):
 		return StateManager.Timer(length, self)
 
+	@property
+	def alpha(self) -> float:
+		"""How far (0.0 to 1.0) the current rendered frame is between the last logic tick and the next one. Use in update_draw to interpolate"""
+		clock = getattr(self.game, "clock", None)
+		return clock.alpha if clock is not None else 0.0
+
 	def update(self):
+		"""Advance by one logic tick. With a fixed timestep the deltatime is the tick length rather than the wall time since the last update"""
 		self.frames_since_start += 1
 
 		t = time.time()
-		self.deltatime = t - self.time_now
+		clock = getattr(self.game, "clock", None)
+		self.deltatime = clock.tick_length if clock is not None and clock.tick_rate else t - self.time_now
 		self.time_now = t
+		self.sim_time += self.deltatime
 
 
 class ClockManager(GameModule):
+	"""GameModule that caps the framerate and, if given a tick_rate, schedules fixed length logic ticks
+
+	Real time between frames is added to an accumulator, and each frame runs as many ticks as fit into it (up to max_ticks_per_frame).
+	The remaining fraction of a tick is exposed as alpha for interpolating in update_draw.
+	With a tick_rate of 0 every frame runs exactly one tick, which is the old frame-locked behaviour
+	"""
+
 	IDMARKER = "clock"
 
-	def create(self, framerate=60):
+	def create(self, framerate=60, tick_rate=0, max_ticks_per_frame=5, max_frame_skip=5):
+		"""Create the clock. framerate caps rendered frames per second (0 for uncapped), tick_rate is the number of logic ticks per second"""
 		self.framerate = framerate
 		self.clock = pygame.time.Clock()
 
+		self.max_ticks_per_frame = max_ticks_per_frame
+		self.max_frame_skip = max_frame_skip
+		self.set_tick_rate(tick_rate)
+
+	def set_tick_rate(self, tick_rate):
+		"""Change the logic tick rate. 0 locks one tick to every frame"""
+		self.tick_rate = tick_rate
+		self.tick_length = 1 / tick_rate if tick_rate else 0.0
+		self.alpha = 0.0
+		self._accumulator = 0.0
+		self._skipped = 0
+
 	def update(self):
+		"""Wait for the next frame and add the elapsed real time to the tick accumulator"""
 		self.clock.tick(self.framerate)
 
+		if self.tick_rate:
+			# Cap the backlog so a long stall (e.g. loading) does not cause a burst of catch-up ticks
+			backlog = self.tick_length * self.max_ticks_per_frame * 2
+			self._accumulator = min(self._accumulator + self.clock.get_time() / 1000, backlog)
+
+	def ticks_due(self) -> int:
+		"""Get the number of logic ticks to run this frame, and consume them from the accumulator"""
+		if not self.tick_rate:
+			return 1
+
+		n = min(int(self._accumulator // self.tick_length), self.max_ticks_per_frame)
+		self._accumulator -= n * self.tick_length
+		self.alpha = min(self._accumulator / self.tick_length, 1.0)
+		return n
+
+	def render_due(self) -> bool:
+		"""Check if this frame should be rendered. Rendering is skipped while the logic is still behind, for up to max_frame_skip frames in a row"""
+		if self.tick_rate and self._accumulator >= self.tick_length and self._skipped < self.max_frame_skip:
+			self._skipped += 1
+			return False
+
+		self._skipped = 0
+		return True
+
 
 class GameloopManager(GameModule):
 	IDMARKER = "loop"
 	REQUIREMENTS = ["sprites"]
 
-	def create(self, loop_hook=None):
+	def create(self, loop_hook=None, draw_hook=None):
+		"""Create the gameloop
+
+		loop_hook runs once per frame. If a draw_hook is also given the loop uses a fixed timestep instead:
+		loop_hook runs once per logic tick owed by the ClockManager and draw_hook runs once per rendered frame
+		"""
 		self.running = False
 		self.game.loop = self
 		self._hook = loop_hook
+		self._draw_hook = draw_hook
 
-	def set_hook(self, new_hook):
+	def set_hook(self, new_hook, draw_hook=None):
 		self._hook = new_hook
+		self._draw_hook = draw_hook
 
 	def stop(self):
 		self.running = False
@@ -75,9 +137,24 @@ class GameloopManager(GameModule):
 	def do_running(self):
 		if self._hook is None:
 			self.game.sprites.update()
+		elif self._draw_hook is None:
+			self._hook(self)
 		else:
+			self.do_fixed_step()
+
+	def do_fixed_step(self):
+		"""Run the logic ticks owed for this frame, then draw unless the ClockManager is skipping frames to catch up"""
+		clock = self.game.clock
+		clock.update()
+
+		for _ in range(clock.ticks_due()):
 			self._hook(self)
 
+		if clock.render_due():
+			self._draw_hook(self)
+		else:
+			pygame.event.pump()
+
 	def run(self, inithook):
 		if self.running:
 			inithook()
@@ -89,6 +89,69 @@ class InputManagerScalingMouse(InputManager):
 		self._mouse_rel = Vector2(mr.x * scale.x, mr.y * scale.y)
 
 
+class ScriptedInputManager(InputManager):
+	"""InputManager that reads injected input instead of pygame's, so the game can be driven without a display
+
+	If a script is given it is called with the ScriptedInputManager and the number of updates so far at the start of every update.
+	The script (or anything else) moves the mouse and holds buttons and keys with the set_ methods, and the state is picked up by that update
+	"""
+
+	class HeldKeys():
+		"""Stand-in for pygame.key.get_pressed() that can be indexed by any key code"""
+
+		__slots__ = ["_held"]
+
+		def __init__(self, held=frozenset()):
+			self._held = held
+
+		def __getitem__(self, key_code):
+			return key_code in self._held
+
+	def create(self, script=None):
+		"""Create ScriptedInputManager. script is an optional callable taking (input, tick)"""
+		super().create()
+		self.keys = ScriptedInputManager.HeldKeys()
+		self._last_keys = self.keys
+
+		self._script = script
+		self.ticks = 0
+
+		self._held_keys = set()
+		self._held_mouse = (False, False, False)
+		self._injected_pos = Vector2(0, 0)
+
+	def set_script(self, script):
+		self._script = script
+
+	def set_mouse_pos(self, pos):
+		"""Move the mouse to a position in screen coordinates"""
+		self._injected_pos = Vector2(pos)
+
+	def set_mouse_buttons(self, left=False, middle=False, right=False):
+		"""Set which mouse buttons are held down"""
+		self._held_mouse = (left, middle, right)
+
+	def set_keys(self, *key_codes):
+		"""Set which keys are held down. Call with no arguments to release every key"""
+		self._held_keys = set(key_codes)
+
+	def update(self):
+		"""Run the script, then update InputManager state from the injected input"""
+		if self._script is not None:
+			self._script(self, self.ticks)
+		self.ticks += 1
+
+		self._last_keys = self.keys
+		self.keys = ScriptedInputManager.HeldKeys(frozenset(self._held_keys))
+
+		self._last_mouse = self.mouse.copy()
+		self.mouse = MouseState(self._held_mouse)
+
+		self._mouse_pos_last = self._mouse_pos
+		self._mouse_pos = Vector2(self._injected_pos)
+		self._mouse_rel = self._mouse_pos - self._mouse_pos_last
+
+
 def test_UNIT_mousestate():
 	m1 = MouseState()
 	m2 = m1.copy()
@@ -97,3 +160,27 @@ def test_UNIT_mousestate():
 
 	m1.alter((True, False, False))
 	assert m1.LEFT is True
+
+
+def test_UNIT_scriptedinput():
+	inp = ScriptedInputManager(None)
+
+	def script(inp, tick):
+		inp.set_mouse_pos((tick * 10, 0))
+		inp.set_mouse_buttons(left=tick >= 1)
+		if tick == 2:
+			inp.set_keys(pygame.K_LEFT)
+		else:
+			inp.set_keys()
+
+	inp.create(script)
+	inp.update()
+	assert not inp.mouse_down(0)
+
+	inp.update()
+	assert inp.mouse_pressed(0)
+	assert inp.mouse_movement() == Vector2(10, 0)
+
+	inp.update()
+	assert inp.mouse_down(0) and not inp.mouse_pressed(0)
+	assert inp.key_pressed(pygame.K_LEFT) and not inp.key_down(pygame.K_a)
@@ -0,0 +1,187 @@
+"""
+GameModule for timing module updates and sprite layer passes
+"""
+
+import pygame
+from array import array
+import atexit
+import json
+import time
+from typing import Dict, List, Optional
+
+from .modulebase import GameModule
+
+__all__ = ["RingBuffer", "ProfilerModule"]
+
+
+class RingBuffer():
+	"""Fixed size buffer of floats that overwrites its oldest values once full"""
+
+	def __init__(self, size: int):
+		self._data = array("d", bytes(8 * size))
+		self._size = size
+		self._idx = 0
+		self._count = 0
+
+	def push(self, value: float):
+		self._data[self._idx] = value
+		self._idx = (self._idx + 1) % self._size
+		self._count = min(self._count + 1, self._size)
+
+	def values(self) -> List[float]:
+		"""Get the stored values from oldest to newest"""
+		if self._count < self._size:
+			return self._data[:self._count].tolist()
+		return (self._data[self._idx:] + self._data[:self._idx]).tolist()
+
+	def last(self) -> float:
+		return self._data[self._idx - 1] if self._count else 0.0
+
+	def __len__(self) -> int:
+		return self._count
+
+
+def percentile(ordered: List[float], p: float) -> float:
+	"""Nearest-rank percentile of an already sorted list"""
+	if not ordered:
+		return 0.0
+	return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+class ProfilerModule(GameModule):
+	"""GameModule that records how long module updates and sprite layer passes take
+
+	Methods are wrapped in place (see wrap, wrap_modules and wrap_layers) so the code being measured does not change.
+	Time spent in each wrapped method is summed over a frame, since several logic ticks can run per frame, and stored in a RingBuffer when update is called at the end of the frame.
+	The frame-time graph is drawn through the DebugOverlayManager and toggled with toggle_key
+	"""
+
+	IDMARKER = "profiler"
+	REQUIREMENTS = ["sprites"]
+
+	def create(self, history: int = 600, dump_path: Optional[str] = None, budget: float = 1 / 60, toggle_key=pygame.K_F3):
+		"""Create the ProfilerModule, keeping history frames of timings. If dump_path is given the percentiles are written there on exit"""
+		self.history = history
+		self.budget = budget
+		self.frame_times = RingBuffer(history)
+		self.show_graph = False
+
+		self._rings: Dict[str, RingBuffer] = {}
+		self._current: Dict[str, float] = {}
+		self._last_frame = None
+		self._toggle_key = toggle_key
+		self._toggle_down = False
+
+		self._dump_path = dump_path
+		if dump_path is not None:
+			atexit.register(self.dump)
+
+	def timed(self, label: str, func):
+		"""Get a version of func that adds its wall time to label for the current frame"""
+		current = self._current
+		clock = time.perf_counter
+
+		def wrapper(*args, **kwargs):
+			start = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				current[label] = current.get(label, 0.0) + clock() - start
+
+		return wrapper
+
+	def wrap(self, obj, method_name: str, label: Optional[str] = None):
+		"""Replace obj.method_name with a timed version. The label defaults to the method name"""
+		label = label or method_name
+		setattr(obj, method_name, self.timed(label, getattr(obj, method_name)))
+		self._rings.setdefault(label, RingBuffer(self.history))
+
+	def wrap_modules(self, *idmarkers, exclude=()):
+		"""Time the update method of each module
+
+		If no idmarkers are given every module added so far that has an update method is wrapped, except the profiler and those in exclude
+		"""
+		if not idmarkers:
+			idmarkers = [
+				module.IDMARKER for module in self.game._modules
+				if module is not self and module.IDMARKER not in exclude and callable(getattr(module, "update", None))
+			]
+
+		for name in idmarkers:
+			self.wrap(getattr(self.game, name), "update", name)
+
+	def wrap_layers(self):
+		"""Time the update_move and update_draw passes of every sprite layer"""
+		for name in self.game.sprites.layer_names():
+			layer = self.game.sprites.get_layer(name)
+			self.wrap(layer, "update_move", f"move:{name}")
+			self.wrap(layer, "update_draw", f"draw:{name}")
+
+	def labels(self) -> List[str]:
+		return list(self._rings.keys())
+
+	def last(self, label: str) -> float:
+		"""Get the time spent in a label on the last complete frame"""
+		return self._rings[label].last()
+
+	def update(self):
+		"""End the current frame. Must be called once per rendered frame, after everything that is wrapped"""
+		now = time.perf_counter()
+		if self._last_frame is not None:
+			self.frame_times.push(now - self._last_frame)
+		self._last_frame = now
+
+		for label, ring in self._rings.items():
+			ring.push(self._current.get(label, 0.0))
+		self._current.clear()
+
+		down = self.game.input.key_down(self._toggle_key)
+		if down and not self._toggle_down:
+			self.show_graph = not self.show_graph
+		self._toggle_down = down
+
+		if self.show_graph:
+			self._draw_graph()
+
+	def _draw_graph(self):
+		debug = self.game.debug
+		frame_ms = self.frame_times.last() * 1000
+		debug.output(f"frame {frame_ms:.1f}ms")
+
+		slowest = sorted(self._rings.items(), key=lambda pair: pair[1].last(), reverse=True)[:5]
+		for label, ring in slowest:
+			debug.output(f"{label} {ring.last() * 1000:.2f}ms")
+
+		debug.graph(self.frame_times.values(), self.budget * 2, marker=self.budget)
+
+	def stats(self) -> Dict[str, Dict[str, float]]:
+		"""Get the mean, 50th, 90th and 99th percentile and maximum of the frame time and every label, in milliseconds"""
+		stats = {}
+		for label, ring in [("frame", self.frame_times), *self._rings.items()]:
+			ordered = sorted(v * 1000 for v in ring.values())
+			stats[label] = {
+				"mean": sum(ordered) / len(ordered) if ordered else 0.0,
+				"p50": percentile(ordered, 50),
+				"p90": percentile(ordered, 90),
+				"p99": percentile(ordered, 99),
+				"max": ordered[-1] if ordered else 0.0,
+				"frames": len(ordered),
+			}
+		return stats
+
+	def dump(self, path: Optional[str] = None):
+		"""Write stats to a json file"""
+		with open(path or self._dump_path, "w") as file:
+			json.dump(self.stats(), file, indent=4)
+
+
+def test_UNIT_ringbuffer():
+	ring = RingBuffer(3)
+	assert ring.values() == []
+
+	for v in (1, 2, 3, 4):
+		ring.push(v)
+
+	assert ring.values() == [2.0, 3.0, 4.0]
+	assert ring.last() == 4.0
+	assert percentile(sorted(ring.values()), 50) == 3.0
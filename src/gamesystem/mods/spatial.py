@@ -0,0 +1,65 @@
+from .modulebase import GameModule
+from ..common.spatial import SpatialHash
+
+from pygame import Rect, FRect
+from typing import Any, Dict, List, Optional, Union
+
+
+class SpatialHashModule(GameModule):
+	"""GameModule for broadphase collision queries against sprite layers
+
+	Each indexed layer gets its own SpatialHash. The SpritesManager inserts sprites when they are added, and refreshes a layer after its update_move pass so moved rects are re-bucketed.
+	Destroyed sprites are dropped on refresh and are never returned from queries
+	"""
+
+	IDMARKER = "spatial"
+	REQUIREMENTS = ["sprites"]
+
+	def create(self, layers: List[str], cell_size: int = 256):
+		"""Create a SpatialHashModule that indexes the given layers. Every sprite in an indexed layer must have a rect"""
+		self._grids: Dict[str, SpatialHash] = {k: SpatialHash(cell_size) for k in layers}
+		self.game.sprites.set_spatial_index(self)
+
+	def indexes(self, layer_name: str) -> bool:
+		return layer_name in self._grids
+
+	def insert(self, sprite, layer_name: str):
+		"""Start tracking a sprite. Sprites added to layers that are not indexed are ignored"""
+		grid = self._grids.get(layer_name)
+		if grid is not None:
+			grid.insert(sprite)
+
+	def refresh(self, *layer_names):
+		"""Re-bucket sprites whose rects have moved and drop destroyed sprites
+
+		If nothing is passed for layer_names then refresh every indexed layer
+		"""
+		for k in layer_names or self._grids.keys():
+			grid = self._grids.get(k)
+			if grid is None:
+				continue
+
+			for sprite in grid:
+				if sprite.is_destroyed():
+					grid.remove(sprite)
+				else:
+					grid.update(sprite)
+
+	def query(self, layer_name: str, rect: Union[Rect, FRect]) -> List[Any]:
+		"""Get all live sprites in a layer colliding with rect, in the order they were added"""
+		return [s for s in self._grids[layer_name].query(rect) if not s.is_destroyed()]
+
+	def query_point(self, layer_name: str, point) -> List[Any]:
+		"""Get all live sprites in a layer containing point, in the order they were added"""
+		return [s for s in self._grids[layer_name].query_point(point) if not s.is_destroyed()]
+
+	def first(self, layer_name: str, rect: Union[Rect, FRect], exclude=None) -> Optional[Any]:
+		"""Get the first live sprite in a layer colliding with rect, or None"""
+		for s in self._grids[layer_name].query(rect):
+			if s is not exclude and not s.is_destroyed():
+				return s
+		return None
+
+	def any(self, layer_name: str, rect: Union[Rect, FRect], exclude=None) -> bool:
+		"""Check if any live sprite in a layer collides with rect"""
+		return self.first(layer_name, rect, exclude) is not None
@@ -1,9 +1,245 @@
 from .baseclass import BaseSpriteManager
 from collections import OrderedDict
 from .modulebase import GameModule
+from ..common.drawstate import bounding_rect, draws
+from pygame import Surface
+import pygame
+from bisect import bisect_left, insort
+from operator import attrgetter
+import itertools
 import logging
 
 
+_drawkey = attrgetter("_drawkey")
+
+
+class SpriteLayer():
+	"""A single layer of sprites in a SpritesManager
+
+	Sprites are kept in insertion order for update_move, and in a second list ordered by (z, insertion order) for update_draw.
+	The draw list is only re-sorted for sprites whose z changed, which they report through the Sprite.z setter.
+	Destroyed sprites are dropped during the pass that skips over them, so removal needs no extra walk over the layer
+
+	Newly added sprites wait in a pending list until the SpritesManager merges them in.
+	The version counter is bumped whenever the layer's membership changes (a sprite is added, destroyed, or the layer is cleared), and the read-only view is only rebuilt when it is out of date
+	"""
+
+	def __init__(self):
+		self.sprites = []
+		self.ordered = []
+		self.pending = []
+		self.version = 0
+		self._view = ()
+		self._view_version = 0
+		self._z_changed = {}
+		self._seq = 0
+
+	def add(self, sprite):
+		"""Add a sprite to the pending list. It becomes part of the update and draw passes on the next merge"""
+		sprite._layer = self
+		self.pending.append(sprite)
+		self.version += 1
+
+	def merge(self):
+		"""Move pending sprites into the update and draw lists"""
+		for sprite in self.pending:
+			if sprite._destroyed:
+				continue
+
+			sprite._drawkey = (sprite._z, self._seq)
+			self._seq += 1
+
+			self.sprites.append(sprite)
+			insort(self.ordered, sprite, key=_drawkey)
+
+		self.pending.clear()
+
+	def clear(self):
+		"""Remove all merged sprites. Pending sprites are kept"""
+		for sprite in self.sprites:
+			sprite._layer = None
+		self.sprites = []
+		self.ordered = []
+		self._z_changed = {}
+		self.version += 1
+
+	def view(self) -> tuple:
+		"""Get a tuple of every live sprite in the layer, including pending ones. The same tuple is returned until the membership changes"""
+		if self._view_version != self.version:
+			self._view = tuple(s for s in itertools.chain(self.sprites, self.pending) if not s._destroyed)
+			self._view_version = self.version
+		return self._view
+
+	def _notify_destroyed(self, sprite):
+		self.version += 1
+
+	def _notify_z(self, sprite):
+		self._z_changed[sprite] = None
+
+	def _resort(self):
+		"""Move sprites whose z changed since the last draw to their new position in the draw list
+
+		Pending sprites are skipped, as merge keys them by their z at that point
+		"""
+		for sprite in self._z_changed:
+			drawkey = getattr(sprite, "_drawkey", None)
+			if drawkey is None:
+				continue
+
+			z, seq = drawkey
+			if sprite._z == z or sprite._destroyed:
+				continue
+
+			i = bisect_left(self.ordered, sprite._drawkey, key=_drawkey)
+			if i == len(self.ordered) or self.ordered[i] is not sprite:
+				continue
+
+			del self.ordered[i]
+			sprite._drawkey = (sprite._z, seq)
+			insort(self.ordered, sprite, key=_drawkey)
+
+		self._z_changed.clear()
+
+	def update_move(self):
+		"""Run update_move for every sprite, dropping any that are or become destroyed"""
+		dead = False
+		for sprite in self.sprites:
+			if sprite._destroyed:
+				dead = True
+				continue
+
+			sprite.update_move()
+			dead = dead or sprite._destroyed
+
+		if dead:
+			self.sprites = [s for s in self.sprites if not s._destroyed]
+
+	def update_draw(self):
+		"""Run update_draw for every sprite in z order, dropping destroyed sprites from the draw list"""
+		if self._z_changed:
+			self._resort()
+
+		dead = False
+		for sprite in self.ordered:
+			if sprite._destroyed:
+				dead = True
+				continue
+
+			sprite.update_draw()
+
+		if dead:
+			self.ordered = [s for s in self.ordered if not s._destroyed]
+
+	def __len__(self):
+		return len(self.sprites)
+
+	def __iter__(self):
+		return iter(self.sprites)
+
+
+class RetainedSpriteLayer(SpriteLayer):
+	"""SpriteLayer that keeps what its sprites draw in a composite Surface the size of the screen, and blits that to the screen once per frame
+
+	Each frame every sprite's draw_state is compared against the last frame (see Sprite.draw_state), like the window systems do in dirty rect mode.
+	Only the regions of sprites that changed, were added or were removed are cleared and redrawn into the composite, by every sprite overlapping them.
+	Sprites draw to the window system's screen as usual, which points at the composite while they are being redrawn.
+	A sprite that draws but returns None from draw_state makes the whole layer redraw every frame while it is alive
+
+	The composite starts out transparent, and a Surface without per-pixel alpha blitted onto a transparent pixel is copied as if it were opaque, whatever its surface alpha.
+	Sprites that blend onto the layer must use Surfaces with per-pixel alpha
+	"""
+
+	def __init__(self, game):
+		super().__init__()
+		self.composite = None
+		self.redraws = 0
+		self._game = game
+		self._states = {}  # Sprite -> (bounding Rect or None, (region, appearance)) from the last frame
+		self._had_untracked = False
+
+	def update_draw(self):
+		"""Redraw the changed regions of the composite, then blit the composite to the screen"""
+		window = self._game.windowsystem
+		screen = window.screen
+		full = False
+		if self.composite is None or self.composite.get_size() != screen.get_size():
+			self.composite = Surface(screen.get_size(), pygame.SRCALPHA)
+			self._states = {}
+			full = True
+
+		# Sprites that moved in the draw order change how they overlap their neighbours
+		dirty = [self._states[sprite][0] for sprite in self._z_changed if sprite in self._states and self._states[sprite][0] is not None]
+		if self._z_changed:
+			self._resort()
+
+		drawn = []  # (sprite, bounding Rect or None, tracked) in draw order
+		states = {}
+		untracked = False
+		dead = False
+		for sprite in self.ordered:
+			if sprite._destroyed:
+				dead = True
+				continue
+
+			state = sprite.draw_state()
+			if state is None:
+				if draws(sprite):
+					untracked = True
+					drawn.append((sprite, None, False))
+				continue
+
+			region, appearance = state
+			key = (tuple(region), appearance)
+			region = bounding_rect(region) if region[2] > 0 and region[3] > 0 else None
+
+			entry = self._states.pop(sprite, None)
+			if entry is None or entry[1] != key:
+				if entry is not None and entry[0] is not None:
+					dirty.append(entry[0])
+				if region is not None:
+					dirty.append(region)
+
+			states[sprite] = (region, key)
+			if region is not None:
+				drawn.append((sprite, region, True))
+
+		if dead:
+			self.ordered = [s for s in self.ordered if not s._destroyed]
+
+		# Sprites left over from the last frame have been destroyed or removed, so the region they last drew to is stale
+		dirty.extend(entry[0] for entry in self._states.values() if entry[0] is not None)
+		self._states = states
+
+		full = full or untracked or self._had_untracked
+		self._had_untracked = untracked
+
+		composite_rect = self.composite.get_rect()
+		if full or dirty:
+			clip = composite_rect if full else composite_rect.clip(dirty[0].unionall(dirty[1:]))
+			self.composite.set_clip(clip)
+			self.composite.fill((0, 0, 0, 0))
+
+			window.screen = self.composite
+			try:
+				for sprite, region, tracked in drawn:
+					if not tracked or region.colliderect(clip):
+						sprite.update_draw()
+			finally:
+				window.screen = screen
+				self.composite.set_clip(None)
+
+			self.redraws += 1
+
+		if not drawn:
+			return
+
+		if untracked:
+			screen.blit(self.composite, (0, 0))
+		else:
+			bounds = composite_rect.clip(drawn[0][1].unionall([region for _, region, _ in drawn[1:]]))
+			screen.blit(self.composite, bounds, bounds)
+
+
 class SpritesManager(BaseSpriteManager):
 	"""GameModule for managing sprites
 
@@ -14,30 +250,34 @@ class SpritesManager(BaseSpriteManager):
 
 	IDMARKER = "sprites"
 
-	def create(self, layers):
+	def create(self, layers, retained=()):
 		"""Create a SpritesManager with given layer names
 
+		Layers named in retained are RetainedSpriteLayers, which are composited once and only redrawn where their sprites change.
 		Also adds a SpriteGlobalsManager for managing aliases to specific important sprites
 		"""
 
 		self._sprites = OrderedDict()
 		for k in layers:
-			self._sprites[k] = []
+			self._sprites[k] = RetainedSpriteLayer(self.game) if k in retained else SpriteLayer()
 
-		self._queue = {}
-		for k in layers:
-			self._queue[k] = []
+		self._spatial = None
 
 		self.game.add_module(SpriteGlobalsManager)
 
+	def set_spatial_index(self, index):
+		"""Attach a spatial index (such as SpatialHashModule) that is kept up to date as sprites are added and moved"""
+		self._spatial = index
+
 	def new(self, new_sprite, layer_override=None):
 		"""Add a new sprite to its assigned layer.
 		If a string is passed for layer_override the use that value instead of Sprite.LAYER
 		"""
-		if layer_override is not None:
-			self._queue[layer_override].append(new_sprite)
-		else:
-			self._queue[new_sprite.LAYER].append(new_sprite)
+		layer = layer_override if layer_override is not None else new_sprite.LAYER
+		self._sprites[layer].add(new_sprite)
+
+		if self._spatial is not None:
+			self._spatial.insert(new_sprite, layer)
 
 	def news(self, *new_sprites, layer_override=None):
 		for sprite in new_sprites:
@@ -47,16 +287,32 @@ class SpritesManager(BaseSpriteManager):
 		"""Return a list of layer names"""
 		return self._sprites.keys()
 
-	def add_layer(self, layer_name):
-		"""Add a new layer to the SpritesManager. Layer cannot already exist"""
+	def add_layer(self, layer_name, retained=False):
+		"""Add a new layer to the SpritesManager. Layer cannot already exist. If retained is True it is a RetainedSpriteLayer"""
 		if layer_name in self.layer_names():
 			raise KeyError(f"Layer '{layer_name}' cannot be created as it already exists")
 
-		self._sprites[layer_name] = []
+		self._sprites[layer_name] = RetainedSpriteLayer(self.game) if retained else SpriteLayer()
+
+	def get_layer(self, layer_name) -> SpriteLayer:
+		"""Get the SpriteLayer object for a layer name"""
+		return self._sprites[layer_name]
+
+	def get(self, layer_name) -> tuple:
+		"""Get a read-only tuple of the live sprites in a layer, including ones added this frame
 
-	def get(self, layer_name):
-		"""Get a layer of sprites"""
-		return list(filter(lambda s: not s.is_destroyed(), self._sprites[layer_name])) + self._queue[layer_name]
+		The tuple is cached and only rebuilt when sprites are added to or destroyed in the layer, so it is cheap to call every frame.
+		Copy it with list() before mutating
+		"""
+		return self._sprites[layer_name].view()
+
+	def iterate(self, layer_name):
+		"""Iterate over the live sprites in a layer without building a new list"""
+		return iter(self._sprites[layer_name].view())
+
+	def version(self, layer_name) -> int:
+		"""Get the membership version of a layer. It changes whenever a sprite is added to or destroyed in the layer"""
+		return self._sprites[layer_name].version
 
 	def purge(self, *layer_names):
 		"""Delete all sprites from layers
@@ -70,7 +326,7 @@ class SpritesManager(BaseSpriteManager):
 			for x in layer_names:
 				for sprite in self._sprites[x]:
 					sprite.destroy()
-				self._sprites[x] = []
+				self._sprites[x].clear()
 
 	def purge_preserve(self, *preserve):
 		"""Purge all layers NOT passed in preserve"""
@@ -81,9 +337,9 @@ class SpritesManager(BaseSpriteManager):
 		return sum(len(x) for x in self._sprites.values())
 
 	def _merge_queue(self):
-		for layer, sprites in self._queue.items():
-			for _ in range(len(sprites)):
-				self._sprites[layer].append(sprites.pop(0))
+		for layer in self._sprites.values():
+			if layer.pending:
+				layer.merge()
 
 	def update(self):
 		"""Update all sprites in the SpritesManager
@@ -94,31 +350,34 @@ class SpritesManager(BaseSpriteManager):
 		- Checking if the sprite is destroyed and removing it if so
 		- Running update_move
 		- Checking again if the sprite is destroyed and removing it
+		- Refreshing the spatial index for the layer, if one is attached
 		- Updating the SpriteGlobalsManager to ensure the validity of the aliases
-		- Iterating over all layers and sprites and running update_draw for each Sprite
+		- Iterating over all layers and running update_draw for each Sprite in z order
 		"""
-		self._merge_queue()
+		self.update_move()
+		self.update_draw()
 
-		for k in self._sprites.keys():
-			x = self._sprites.get(k)
-			keep = []
-			for sprite in x:
-				if sprite.is_destroyed():
-					continue
+	def update_move(self):
+		"""Run the update_move pass over every layer, then merge sprites that were added during it"""
+		self._merge_queue()
 
-				sprite.update_move()
+		# Sprites may have been moved by other modules since the last frame
+		if self._spatial is not None:
+			self._spatial.refresh()
 
-				if not sprite.is_destroyed():
-					keep.append(sprite)
+		for k, layer in self._sprites.items():
+			layer.update_move()
 
-			self._sprites[k] = [s for s in keep]
+			if self._spatial is not None:
+				self._spatial.refresh(k)
 
 		self.game.spriteglobals.update()
 		self._merge_queue()
 
-		for x in self._sprites.values():
-			for sprite in sorted(x, key=lambda spr: spr.z):
-				sprite.update_draw()
+	def update_draw(self):
+		"""Run the update_draw pass over every layer"""
+		for layer in self._sprites.values():
+			layer.update_draw()
 
 
 class SpriteGlobalsManager(GameModule):
@@ -176,3 +435,82 @@ class StallingSpriteManager(SpritesManager):
 			self._stall_frames -= 1
 
 		self._update_draw()
+
+
+def test_UNIT_spritelayer_draw_order():
+	from ..common.sprite import Sprite
+
+	drawn = []
+
+	class Marker(Sprite):
+
+		def __init__(self, name, z=0):
+			self.name = name
+			self.z = z
+
+		def update_draw(self):
+			drawn.append(self.name)
+
+	layer = SpriteLayer()
+	a, b, c = Marker("a", 1), Marker("b"), Marker("c", 1)
+	for spr in (a, b, c):
+		layer.add(spr)
+	layer.merge()
+
+	layer.update_draw()
+	assert drawn == ["b", "a", "c"]
+
+	drawn.clear()
+	a.z = 2
+	b.destroy()
+	layer.update_draw()
+	assert drawn == ["c", "a"]
+	assert len(layer.ordered) == 2
+
+
+def test_UNIT_spritelayer_pending_z():
+	from ..common.sprite import Sprite
+
+	drawn = []
+
+	class Marker(Sprite):
+
+		def __init__(self, name):
+			self.name = name
+
+		def update_draw(self):
+			drawn.append(self.name)
+
+	layer = SpriteLayer()
+	a, b = Marker("a"), Marker("b")
+	layer.add(a)
+	layer.merge()
+
+	# z set after add but before merge is reported to the layer, and the draw pass must not trip over it
+	layer.add(b)
+	b.z = -1
+	layer.update_draw()
+	assert drawn == ["a"]
+
+	drawn.clear()
+	layer.merge()
+	layer.update_draw()
+	assert drawn == ["b", "a"]
+
+
+def test_UNIT_spritelayer_view_version():
+	from ..common.sprite import Sprite
+
+	layer = SpriteLayer()
+	a, b = Sprite(), Sprite()
+	layer.add(a)
+	view = layer.view()
+	assert view == (a,)
+	assert layer.view() is view
+
+	layer.merge()
+	assert layer.view() is view
+
+	layer.add(b)
+	a.destroy()
+	assert layer.view() == (b,)
@@ -0,0 +1,100 @@
+from .modulebase import GameModule
+
+import pygame.transform
+from pygame import Surface
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+import weakref
+
+
+class TransformCacheModule(GameModule):
+	"""GameModule that memoizes pygame.transform scaling
+
+	Results are keyed by the identity of the source Surface, the operation and the target size rounded to a multiple of quantum pixels.
+	Sources are only weakly referenced, so results are dropped once their source is garbage collected.
+	Once the results take up more than budget bytes the least recently used are evicted
+
+	A source must not be drawn onto after it has been scaled through the cache, or stale results are returned.
+	Results are shared by every caller and must not be drawn onto either, although setting their alpha right before blitting them is fine
+	"""
+
+	IDMARKER = "transforms"
+
+	def create(self, budget: int = 32 * 1024 * 1024, quantum: int = 1):
+		self.budget = budget
+		self.quantum = quantum
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._results: "OrderedDict[Tuple[int, str, int, int], Surface]" = OrderedDict()
+		self._sources: Dict[int, weakref.ref] = {}
+
+	def _quantize(self, size) -> Tuple[int, int]:
+		q = self.quantum
+		return (max(q, round(size[0] / q) * q), max(q, round(size[1] / q) * q))
+
+	def _get(self, surface: Surface, op: str, size) -> Surface:
+		size = self._quantize(size)
+		key = (id(surface), op, *size)
+
+		# An id can be reused by a new Surface once the old one is collected, so check the source is still alive as this Surface
+		source = self._sources.get(key[0])
+		result = self._results.get(key)
+		if result is not None and source is not None and source() is surface:
+			self._results.move_to_end(key)
+			self.hits += 1
+			return result
+
+		self.misses += 1
+		if op == "smoothscale":
+			result = pygame.transform.smoothscale(surface, size)
+		else:
+			result = pygame.transform.scale(surface, size)
+
+		nbytes = result.get_pitch() * result.get_height()
+		if nbytes > self.budget:
+			return result
+
+		if source is None or source() is not surface:
+			self._forget(key[0])
+			self._sources[key[0]] = weakref.ref(surface, lambda _, source=key[0]: self._forget(source))
+
+		self._results[key] = result
+		self.bytes += nbytes
+		while self.bytes > self.budget:
+			old_key, old = self._results.popitem(last=False)
+			self.bytes -= old.get_pitch() * old.get_height()
+			self.evictions += 1
+
+		return result
+
+	def _forget(self, source: int):
+		for key in [key for key in self._results if key[0] == source]:
+			old = self._results.pop(key)
+			self.bytes -= old.get_pitch() * old.get_height()
+		self._sources.pop(source, None)
+
+	def scale(self, surface: Surface, size) -> Surface:
+		return self._get(surface, "scale", size)
+
+	def scale_by(self, surface: Surface, factor: Union[float, Tuple[float, float]]) -> Surface:
+		fx, fy = (factor, factor) if isinstance(factor, (int, float)) else factor
+		return self._get(surface, "scale", (surface.get_width() * fx, surface.get_height() * fy))
+
+	def smoothscale(self, surface: Surface, size) -> Surface:
+		return self._get(surface, "smoothscale", size)
+
+	def clear(self):
+		self._results.clear()
+		self._sources.clear()
+		self.bytes = 0
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			"entries": len(self._results),
+			"bytes": self.bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
@@ -6,10 +6,16 @@ import pygame
 from pygame import Surface, Vector2, Color, Rect
 
 import sys
+import math
 from .modulebase import GameModule
+from ..common.drawstate import bounding_rect, draws
 from types import SimpleNamespace
 
 
+# Above this fraction of the screen a dirty region is treated as a full redraw
+FULL_REDRAW_RATIO = 0.6
+
+
 class WInfoModule(GameModule):
 	IDMARKER = "winfo"
 
@@ -25,8 +31,13 @@ class BasicWindowSystem(GameModule):
 	IDMARKER = "windowsystem"
 	REQUIREMENTS = ["loop"]
 
-	def create(self, size: Vector2, caption="pygame window", flags=pygame.SHOWN, fill_color=Color(0, 0, 0)):
-		"""Create the window from a size. Optionally set the caption, pygame flags, and fill color"""
+	def create(
+		self, size: Vector2, caption="pygame window", flags=pygame.SHOWN, fill_color=Color(0, 0, 0), dirty_rects=False
+	):
+		"""Create the window from a size. Optionally set the caption, pygame flags, and fill color
+
+		If dirty_rects is True the screen is not cleared every frame. Instead only the regions where sprites changed are cleared, redrawn and presented (see begin_draw)
+		"""
 
 		self.dimensions = Vector2(size)
 		self.rect = Rect(0, 0, self.dimensions.x, self.dimensions.y)
@@ -39,20 +50,122 @@ class BasicWindowSystem(GameModule):
 		pygame.display.set_caption(caption)
 		self._bgc = fill_color
 
+		self.dirty_rects = dirty_rects
+		self._dirty = []
+		self._tracked = {}
+		self._frame = 0
+		self._full_redraw = True
+		self._had_untracked = False
+		self._region = None
+
 	def set_fill_color(self, fill_color: Color):
 		"""Set the background fill color"""
 		self._bgc = fill_color
+		self.mark_all_dirty()
 
-	def update(self):
-		"""Update the window's buffer and handle close events"""
-		pygame.display.flip()
-		self.window.fill(self._bgc)
+	def mark_dirty(self, rect):
+		"""Mark a region of the screen as changed in dirty rect mode, so it is redrawn this frame"""
+		if self.dirty_rects:
+			self._dirty.append(bounding_rect(rect))
+
+	def mark_all_dirty(self):
+		"""Redraw and present the whole screen this frame. If called after begin_draw the whole screen is only presented"""
+		self._full_redraw = True
 
+	def _collect_dirty(self):
+		"""Compare every sprite's draw_state against the previous frame and mark the old and new regions of any that changed
+
+		Sprites that draw but do not report a draw_state force a full redraw, both while they are alive and on the frame after so their last image is erased
+		"""
+		self._frame += 1
+		untracked = False
+
+		for layer_name in self.game.sprites.layer_names():
+			for sprite in self.game.sprites.iterate(layer_name):
+				state = sprite.draw_state()
+				if state is None:
+					untracked = untracked or draws(sprite)
+					continue
+
+				region, appearance = state
+				key = (tuple(region), appearance)
+				region = bounding_rect(region) if region[2] > 0 and region[3] > 0 else None
+
+				entry = self._tracked.get(sprite)
+				if entry is None or entry[1] != key:
+					if entry is not None and entry[0] is not None:
+						self._dirty.append(entry[0])
+					if region is not None:
+						self._dirty.append(region)
+
+				self._tracked[sprite] = (region, key, self._frame)
+
+		# Sprites that were not seen this frame have been destroyed or removed, so the region they last drew to is stale
+		gone = [sprite for sprite, entry in self._tracked.items() if entry[2] != self._frame]
+		for sprite in gone:
+			region = self._tracked.pop(sprite)[0]
+			if region is not None:
+				self._dirty.append(region)
+
+		if untracked or self._had_untracked:
+			self._full_redraw = True
+		self._had_untracked = untracked
+
+	def _take_region(self):
+		"""Get the region that is redrawn this frame, or None for the whole screen, and reset the dirty state"""
+		region = None
+		if not self._full_redraw:
+			screen_rect = self.screen.get_rect()
+			region = screen_rect.clip(self._dirty[0].unionall(self._dirty[1:])) if self._dirty else Rect(0, 0, 0, 0)
+			if region.width * region.height > screen_rect.width * screen_rect.height * FULL_REDRAW_RATIO:
+				region = None
+
+		self._dirty = []
+		self._full_redraw = False
+		return region
+
+	def begin_draw(self):
+		"""Prepare the screen for the sprites' update_draw pass. Must run after update_move and before update_draw
+
+		In dirty rect mode this clears only the region that changed and clips drawing to it. Otherwise it does nothing
+		"""
+		if not self.dirty_rects:
+			return
+
+		self._collect_dirty()
+		self._region = self._take_region()
+
+		if self._region is None:
+			self.screen.set_clip(None)
+			self.screen.fill(self._bgc)
+		else:
+			self.screen.set_clip(self._region)
+			self.screen.fill(self._bgc, self._region)
+
+	def _present_region(self, region):
+		if self._full_redraw or region is None:
+			pygame.display.flip()
+		elif region.width and region.height:
+			pygame.display.update(region)
+
+	def _handle_events(self):
 		for event in pygame.event.get():
 			if event.type == pygame.QUIT:
 				pygame.quit()
 				sys.exit()
 
+	def update(self):
+		"""Update the window's buffer and handle close events"""
+		if self.dirty_rects:
+			self._present_region(self._region)
+			self.screen.set_clip(None)
+			self._full_redraw = False
+		else:
+			pygame.display.flip()
+			self.window.fill(self._bgc)
+
+		self._handle_events()
+
 
 class ScalingWindowSystem(BasicWindowSystem):
 	"""A window system that scales a Surface to fit the window size"""
@@ -80,11 +193,80 @@ class ScalingWindowSystem(BasicWindowSystem):
 		self.scale_up = Vector2(self.udimensions.x / self.dimensions.x, self.udimensions.y / self.dimensions.y)
 		self.scale_down = Vector2(self.dimensions.x / self.udimensions.x, self.dimensions.y / self.udimensions.y)
 
+	def begin_draw(self):
+		"""Prepare the internal screen for the sprites' update_draw pass. Must run after update_move and before update_draw
+
+		In dirty rect mode this clears only the region that changed and clips drawing to it. Otherwise it does nothing
+		"""
+		if not self.dirty_rects:
+			return
+
+		self._collect_dirty()
+		self._region = self._take_region()
+
+		if self._region is None:
+			self.screen.set_clip(None)
+			self.screen.fill((0, 0, 0, 0))
+		else:
+			self.screen.set_clip(self._region)
+			self.screen.fill((0, 0, 0, 0), self._region)
+
+	def _window_rect(self, region: Rect) -> Rect:
+		"""Scale a region of the internal screen up to window coordinates"""
+		return bounding_rect(
+			(region.x * self.scale_up.x, region.y * self.scale_up.y, region.width * self.scale_up.x, region.height * self.scale_up.y)
+		).clip(self.window.get_rect())
+
+	def _update_dirty(self):
+		"""Present only the changed region of the internal screen. The uscreen overlay is always presented in full"""
+		region = self._region
+		self.screen.set_clip(None)
+
+		if self._full_redraw or region is None:
+			self.window.fill(self._bgc)
+			self.window.blit(pygame.transform.scale(self.screen, self.udimensions), (0, 0))
+			self.window.blit(self.uscreen, (0, 0))
+			pygame.display.flip()
+			self.uscreen.fill((0, 0, 0, 0))
+
+		elif region.width and region.height:
+			wregion = self._window_rect(region)
+			self.window.fill(self._bgc, wregion)
+
+			if self.scale_up == Vector2(1, 1):
+				self.window.blit(self.screen, wregion, wregion)
+			else:
+				# Scale a slightly larger area than needed so edge pixels sample the same source pixels as a full scale would
+				src = self._window_rect(region.inflate(4, 4)).clip(self.window.get_rect())
+				src_region = Rect(
+					math.floor(src.x * self.scale_down.x), math.floor(src.y * self.scale_down.y), 0, 0
+				)
+				src_region.width = math.ceil(src.right * self.scale_down.x) - src_region.x
+				src_region.height = math.ceil(src.bottom * self.scale_down.y) - src_region.y
+				src_region = src_region.clip(self.screen.get_rect())
+
+				scaled = pygame.transform.scale(
+					self.screen.subsurface(src_region),
+					(round(src_region.width * self.scale_up.x), round(src_region.height * self.scale_up.y))
+				)
+				pos = (round(src_region.x * self.scale_up.x), round(src_region.y * self.scale_up.y))
+				self.window.blit(scaled, wregion, wregion.move(-pos[0], -pos[1]))
+
+			self.window.blit(self.uscreen, wregion, wregion)
+			pygame.display.update(wregion)
+
+		self._full_redraw = False
+
 	def update(self):
 		"""Update the window buffer and events.
 		The Surface is scaled to the size of self.udimensions before being blitted
 		"""
 
+		if self.dirty_rects:
+			self._update_dirty()
+			self._handle_events()
+			return
+
 		t = pygame.transform.scale(self.screen, self.udimensions)
 		self.window.blit(t, (0, 0))  # Decide on where to blit later
 		self.window.blit(self.uscreen, (0, 0))
@@ -94,13 +276,26 @@ class ScalingWindowSystem(BasicWindowSystem):
 		self.uscreen.fill((0, 0, 0, 0))
 		self.window.fill(self._bgc)
 
-		for event in pygame.event.get():
-			if event.type == pygame.QUIT:
-				pygame.quit()
-				sys.exit()
+		self._handle_events()
+
+
+class HeadlessWindowSystem(ScalingWindowSystem):
+	"""A ScalingWindowSystem for running without a display, with SDL_VIDEODRIVER set to "dummy"
+
+	Frames are composed exactly as they would be in a real window so rendering costs stay representative, but the window is hidden and presenting is a no-op under the dummy driver
+	"""
+
+	def create(self, size, user_size=None, **kwargs):
+		"""Create the offscreen window. user_size defaults to size so no scaling is done"""
+		kwargs.setdefault("flags", pygame.HIDDEN)
+		super().create(size, user_size if user_size is not None else size, **kwargs)
 
 
 class AspectScalingWindowSystem(ScalingWindowSystem):
+	def create(self, *args, **kwargs):
+		super().create(*args, **kwargs)
+		self.dirty_rects = False  # Dirty rect mode does not support letterboxing
+
 	def update(self):
 		"""Update the window buffer and events.
 		The Surface is scaled to the size of self.udimensions before being blitted
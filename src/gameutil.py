@@ -4,11 +4,13 @@ import pygame
 import random
 import math
 from pygame import Vector2, Color, Surface, FRect, Rect
-from typing import List, Union, Iterator, Tuple, Callable, Any, Optional
+from typing import List, Union, Iterator, Tuple, Callable, Any, Optional, Dict
+from collections import OrderedDict
 from consts import VZERO
 from dataclasses import dataclass
 import palette
 import requests
+import numpy as np
 import threading
 import time
 
@@ -70,40 +72,88 @@ class SteppingEasingVector2(EasingVector2):
 		return self(self._step)
 
 
-# Apply a draw function to a Surface, and mask out the drawn on areas
-def surface_keepmask(surface: Surface, masking: Callable[[Surface, Color], Any]) -> Surface:
-	dest = Surface(surface.get_size(), pygame.SRCALPHA)
-	dest2 = Surface(surface.get_size(), pygame.SRCALPHA)
-	dest.blit(surface, VZERO)
+# Cache of procedurally generated decorations: per-pixel alpha masks and blurred shadows
+# These only depend on their size and style, so each is generated once and shared. Past max_entries the least recently used are dropped
+# The cached Surfaces are shared, so they must not be drawn onto
+class DecorationCache:
+
+	def __init__(self, max_entries: int = 256):
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self._entries: OrderedDict[Tuple, Surface] = OrderedDict()
+
+	def _get_or_create(self, key: Tuple, create: Callable[[], Surface]) -> Surface:
+		surf = self._entries.get(key)
+		if surf is not None:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return surf
+
+		self.misses += 1
+		surf = self._entries[key] = create()
+		if len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+		return surf
+
+	# Mask that is opaque white inside a rounded rect covering the whole size, and transparent black outside it
+	def rounded_mask(self, size: Tuple[int, int], corner_radius: int) -> Surface:
+		size = (int(size[0]), int(size[1]))
+		return self._get_or_create(("mask", size, corner_radius), lambda: _draw_mask(
+			size, lambda surf, col: pygame.draw.rect(surf, col, surf.get_rect(), border_radius=corner_radius)
+		))
+
+	# Blurred shadow of a rect drawn onto a Surface of size
+	def shadow(self, size: Tuple[int, int], rect: Rect, colour: Color, shrink_by: int, blur_radius: int, **kwargs) -> Surface:
+		key = ("shadow", (int(size[0]), int(size[1])), tuple(rect), tuple(colour), shrink_by, blur_radius, tuple(sorted(kwargs.items())))
 
-	MASK_BG = Color("#ff00ff")
-	MASK_FG = Color("#ff0000")
+		def create():
+			surf = Surface(size, pygame.SRCALPHA)
+			pygame.draw.rect(surf, colour, rect.inflate(-shrink_by, -shrink_by), **kwargs)
+			return pygame.transform.gaussian_blur(surf, blur_radius)
 
-	mask = Surface(surface.get_size())
-	mask.fill(MASK_BG)
-	masking(mask, MASK_FG)
-	mask.set_colorkey(MASK_FG)
+		return self._get_or_create(key, create)
 
-	dest.blit(mask, VZERO)
-	dest.set_colorkey(MASK_BG)
+	def clear(self):
+		self._entries.clear()
 
-	dest2.blit(dest, VZERO)
+	def stats(self) -> Dict[str, int]:
+		return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
 
-	return dest2
+
+# Shared by everything in the game
+decorations = DecorationCache()
+
+
+# Draw a per-pixel alpha mask, where everything drawn by the masking function is kept
+def _draw_mask(size: Tuple[int, int], masking: Callable[[Surface, Color], Any]) -> Surface:
+	mask = Surface(size, pygame.SRCALPHA)
+	mask.fill((0, 0, 0, 0))
+	masking(mask, Color(255, 255, 255, 255))
+	return mask
+
+
+# Get a per-pixel alpha copy of a Surface with a mask multiplied into it
+def surface_apply_mask(surface: Surface, mask: Surface) -> Surface:
+	dest = Surface(surface.get_size(), pygame.SRCALPHA)
+	dest.blit(surface, VZERO)
+	dest.blit(mask, VZERO, special_flags=pygame.BLEND_RGBA_MULT)
+	return dest
+
+
+# Apply a draw function to a Surface, and mask out the drawn on areas
+def surface_keepmask(surface: Surface, masking: Callable[[Surface, Color], Any]) -> Surface:
+	return surface_apply_mask(surface, _draw_mask(surface.get_size(), masking))
 
 
 # Give a surface rounded corners
 def surface_rounded_corners(surface: Surface, corner_radius: int) -> Surface:
-	return surface_keepmask(
-		surface, lambda surf, col: pygame.draw.rect(surf, col, surf.get_rect(), border_radius=corner_radius)
-	)
+	return surface_apply_mask(surface, decorations.rounded_mask(surface.get_size(), corner_radius))
 
 
-# Generate a blurry shadow Surface given a Rect
+# Generate a blurry shadow Surface given a Rect. The Surface is shared with every other shadow of the same rect and style
 def shadow_from_rect(rect: Rect, colour: Color = Color("#000000aa"), shrink_by=10, blur_radius=8, **kwargs) -> Surface:
-	surf = Surface(rect.size, pygame.SRCALPHA)
-	pygame.draw.rect(surf, colour, rect.inflate(-shrink_by, -shrink_by), **kwargs)
-	return pygame.transform.gaussian_blur(surf, blur_radius)
+	return decorations.shadow(rect.size, rect, colour, shrink_by, blur_radius, **kwargs)
 
 
 # Iterate over every coordinate in a Surface
@@ -116,18 +166,82 @@ def traverse_surface(surface: Surface) -> Iterator[Tuple[int, int]]:
 
 
 # Change a Surface's palette to a set of new colours
+# Works on the Surface's mapped pixel values through a surfarray view, looking every pixel up in a sorted table of the palette's colours at once.
+# As with a per-pixel search, the first entry for a colour wins and recoloured pixels are not matched again
 def transmute_surface_palette(surface: Surface, palette_map: List[Tuple[Color, Color]]) -> Surface:
-	surface.lock()
-	for pos in traverse_surface(surface):
-		c = surface.get_at(pos)
-		newc = next((nc for k, nc in palette_map if k == c), None)
-		if newc:
-			surface.set_at(pos, newc)
-
-	surface.unlock()
+	table = {}
+	for old, new in palette_map:
+		old, new = Color(old), Color(new)
+		pixel = _map_colour(surface, old)
+		# Pixels are matched by the colour they read back as, like get_at would. A colour the Surface cannot hold exactly
+		# (e.g. in 16 bits, or translucent without per-pixel alpha) reads back as another colour, so nothing matches it
+		if surface.unmap_rgb(pixel) == old:
+			table.setdefault(pixel, _map_colour(surface, new))
+	if not table:
+		return surface
+
+	if surface.get_bytesize() == 3:
+		# surfarray has no 2d view of 24 bit Surfaces, so pack the 3d view into integers
+		rgb = pygame.surfarray.pixels3d(surface)
+		pixels = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+		table = {_pack_rgb(surface.unmap_rgb(k)): _pack_rgb(surface.unmap_rgb(v)) for k, v in table.items()}
+	else:
+		pixels = pygame.surfarray.pixels2d(surface)
+
+	keys = np.fromiter(table.keys(), dtype=np.int64)
+	values = np.fromiter(table.values(), dtype=np.int64)
+	order = np.argsort(keys)
+	keys, values = keys[order], values[order]
+
+	idx = np.minimum(np.searchsorted(keys, pixels), len(keys) - 1)
+	hit = keys[idx] == pixels
+
+	if surface.get_bytesize() == 3:
+		packed = values[idx[hit]]
+		rgb[hit] = np.stack([(packed >> 16) & 0xff, (packed >> 8) & 0xff, packed & 0xff], axis=-1)
+		del rgb
+	else:
+		pixels[hit] = values[idx[hit]].astype(pixels.dtype)
+		del pixels
+
 	return surface
 
 
+def _pack_rgb(colour: Color) -> int:
+	return (colour.r << 16) | (colour.g << 8) | colour.b
+
+
+# Mapped pixel value of a colour as it is stored in the Surface, since map_rgb can return it as a negative signed integer
+def _map_colour(surface: Surface, colour: Color) -> int:
+	return surface.map_rgb(colour) & ((1 << (8 * surface.get_bytesize())) - 1)
+
+
+def test_UNIT_transmute_surface_palette():
+	# The per-pixel search transmute_surface_palette replaced
+	def reference(surface, palette_map):
+		for pos in traverse_surface(surface):
+			c = surface.get_at(pos)
+			newc = next((nc for k, nc in palette_map if k == c), None)
+			if newc:
+				surface.set_at(pos, newc)
+		return surface
+
+	rng = random.Random(0)
+	colours = [Color(rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.choice([255, 255, 128])) for _ in range(12)]
+	for flags, depth in [(0, 16), (0, 24), (0, 32), (pygame.SRCALPHA, 32)]:
+		source = Surface((23, 17), flags, depth)
+		for pos in traverse_surface(source):
+			source.set_at(pos, rng.choice(colours))
+
+		# Palette colours are both ones read back from the Surface, and the originals that a 16 bit Surface cannot hold
+		read = [Color(c) for c in dict.fromkeys(tuple(source.get_at(pos)) for pos in traverse_surface(source))]
+		for _ in range(5):
+			palette_map = [(rng.choice(read + colours), rng.choice(colours)) for _ in range(8)]
+			expected = reference(source.copy(), palette_map)
+			result = transmute_surface_palette(source.copy(), palette_map)
+			assert all(expected.get_at(pos) == result.get_at(pos) for pos in traverse_surface(source)), (flags, depth)
+
+
 # Get a region of a Surface defined by a Rect
 def surface_region(surface: Surface, region: Union[Rect, FRect]) -> Surface:
 	target = Surface(region.size, pygame.SRCALPHA)
@@ -145,6 +259,9 @@ class ImageSprite(Sprite):
 	def update_draw(self):
 		game.windowsystem.screen.blit(self.image, self.pos)
 
+	def draw_state(self):
+		return (self.image.get_rect(topleft=self.pos), id(self.image))
+
 
 # Extension of ImageSprite that also upscales the image to the window size
 class ScalingImageSprite(ImageSprite):
@@ -152,7 +269,7 @@ class ScalingImageSprite(ImageSprite):
 	def __init__(self, pos: Vector2, image: Surface):
 		super().__init__(pos, image)
 		self.unscaled = self.image
-		self.image = pygame.transform.scale(self.unscaled, game.windowsystem.dimensions)
+		self.image = game.transforms.scale(self.unscaled, game.windowsystem.dimensions)
 
 
 # Extension of the ScalingImageSprite that also renders a scanline effect on top of the image, darkening it and creating an optical illusion
@@ -162,12 +279,16 @@ class ScanlineImageSprite(ScalingImageSprite):
 		super().__init__(*args, **kwargs)
 		self.image = ScanlineImageSprite._render_scans(self.image.copy(), scans_clr)
 
+	# Set every even row to clr, through a strided surfarray view of the rows
 	@staticmethod
 	def _render_scans(surface: Surface, clr: Color) -> Surface:
-		w = surface.get_width()
-		for y in range(surface.get_height()):
-			if y % 2 == 0:
-				pygame.draw.line(surface, clr, (0, y), (w - 1, y))
+		if surface.get_bytesize() == 3:
+			rows = pygame.surfarray.pixels3d(surface)[:, ::2]
+			rows[...] = tuple(Color(clr))[:3]
+		else:
+			rows = pygame.surfarray.pixels2d(surface)[:, ::2]
+			rows[...] = _map_colour(surface, clr)
+		del rows
 
 		return surface
 
@@ -3,6 +3,8 @@ from gameutil import surface_region
 from prelude import *
 from cards import Card
 from datetime import datetime
+from collections import OrderedDict
+import weakref
 
 
 # User definied modules for streamlining certain game systems
@@ -11,22 +13,36 @@ from datetime import datetime
 @dataclass
 class CachedTexture:
 	texture: Surface
-	keytext: Surface
-	size: Vector2
+	keytext: weakref.ref  # Source Surface the texture was clipped from
+	size: Tuple[int, int]
 
 
 # Clips Surfaces to a certain size, and caches them for further use
+# Entries are keyed by the identity of the source Surface and the integer size. Sources are only weakly referenced, so the clips of a texture the AssetManager
+# has evicted are dropped with it. Once the clipped Surfaces take up more than budget bytes the least recently used are evicted
 class TextureClippingCacheModule(GameModule):
 	IDMARKER = "textclip"
-	_textures: List[CachedTexture]
-
-	def create(self):
-		self._textures = []
+	_textures: "OrderedDict[Tuple[int, int, int], CachedTexture]"
+
+	def create(self, budget: int = 32 * 1024 * 1024):
+		self.budget = budget
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._textures = OrderedDict()
+		self._sources: Dict[int, weakref.ref] = {}  # id of source Surface -> weak reference that drops its entries when it is collected
+		self._keys: Dict[int, Dict[Tuple[int, int, int], None]] = {}  # id of source Surface -> keys of the clips made from it
+
+	@staticmethod
+	def _key(texture: Surface, size: Vector2) -> Tuple[int, int, int]:
+		return (id(texture), int(size[0]), int(size[1]))
 
 	def get_tex(self, texture: Surface, size: Vector2) -> Optional[CachedTexture]:
-		for entry in self._textures:
-			if entry.keytext is texture and size == entry.size:
-				return entry
+		entry = self._textures.get(self._key(texture, size))
+		# An id can be reused by a new Surface once the old one is collected, so check the entry is for this Surface
+		if entry is not None and entry.keytext() is texture:
+			return entry
 		return None
 
 	def contains(self, texture: Surface, size: Vector2):
@@ -39,13 +55,113 @@ class TextureClippingCacheModule(GameModule):
 
 		tex = self.get_tex(texture, size)
 		if tex is not None:
+			self._textures.move_to_end(self._key(texture, size))
+			self.hits += 1
 			return tex.texture
 
-		clipped = surface_region(texture, Rect((0, 0), size))
+		self.misses += 1
+		key = self._key(texture, size)
+		clipped = surface_region(texture, Rect((0, 0), key[1:]))
+		nbytes = clipped.get_pitch() * clipped.get_height()
+
+		# Clips bigger than the whole budget are returned without being cached
+		if nbytes > self.budget:
+			return clipped
+
+		if key[0] not in self._sources:
+			self._sources[key[0]] = weakref.ref(texture, lambda _, source=key[0]: self._forget(source))
+
+		self._textures[key] = CachedTexture(clipped, self._sources[key[0]], key[1:])
+		self._keys.setdefault(key[0], {})[key] = None
+		self.bytes += nbytes
+		while self.bytes > self.budget:
+			old_key, old = self._textures.popitem(last=False)
+			self._drop(old_key, old)
+			self.evictions += 1
 
-		self._textures.append(CachedTexture(clipped, texture, size))
 		return clipped
 
+	# Account for an entry that has been removed from _textures, and stop tracking its source if nothing else was clipped from it
+	def _drop(self, key: Tuple[int, int, int], entry: CachedTexture):
+		self.bytes -= entry.texture.get_pitch() * entry.texture.get_height()
+		keys = self._keys.get(key[0])
+		if keys is not None:
+			keys.pop(key, None)
+			if not keys:
+				del self._keys[key[0]]
+				self._sources.pop(key[0], None)
+
+	# Remove every clip of a source Surface that has been garbage collected
+	def _forget(self, source: int):
+		for key in list(self._keys.get(source, ())):
+			self._drop(key, self._textures.pop(key))
+		self._keys.pop(source, None)
+		self._sources.pop(source, None)
+
+	def clear(self):
+		self._textures.clear()
+		self._sources.clear()
+		self._keys.clear()
+		self.bytes = 0
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			"entries": len(self._textures),
+			"bytes": self.bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+
+@dataclass
+class PrerenderedSurfaces:
+	surfaces: Tuple[Surface, ...]
+	keytext: Optional[weakref.ref]  # Texture the Surfaces were rendered from, if any
+
+
+# Caches Surfaces that sprites render for themselves when they are created, such as card faces and playspace backgrounds,
+# so every sprite of the same kind shares the Surfaces of the first one instead of rendering them again
+# Entries are keyed by a caller supplied tuple (e.g. the card's play_id and size) plus the identity of the texture they were rendered from.
+# Textures are only weakly referenced, so the entries for a texture that has been garbage collected are dropped with it
+# The cached Surfaces are shared, so they must be copied before being drawn onto
+class PrerenderCacheModule(GameModule):
+	IDMARKER = "prerender"
+	_entries: Dict[Tuple, PrerenderedSurfaces]
+
+	def create(self):
+		self.hits = 0
+		self.misses = 0
+		self._entries = {}
+
+	# Return the cached Surfaces for key and texture. Otherwise create them with render and store them
+	def get_or_render(
+		self, key: Tuple, texture: Optional[Surface], render: Callable[[], Tuple[Surface, ...]]
+	) -> Tuple[Surface, ...]:
+		key = (*key, id(texture))
+		entry = self._entries.get(key)
+		if entry is not None and (entry.keytext is None or entry.keytext() is texture):
+			self.hits += 1
+			return entry.surfaces
+
+		self.misses += 1
+		surfaces = tuple(render())
+		keytext = None if texture is None else weakref.ref(texture, lambda _, key=key: self._forget(key))
+		self._entries[key] = PrerenderedSurfaces(surfaces, keytext)
+		return surfaces
+
+	def _forget(self, key):
+		# Only remove the entry if it has not been replaced by one for a new texture with the same id
+		entry = self._entries.get(key)
+		if entry is not None and entry.keytext is not None and entry.keytext() is None:
+			del self._entries[key]
+
+	def clear(self):
+		self._entries.clear()
+
+	def stats(self) -> Dict[str, int]:
+		return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
 
 # Module for providing easy access to JSON data describing the various Cards, Playspaces, and Scenarios in the game
 # These JSON blueprints are used to reproduce Card, Playspace and Scenario objects
@@ -73,6 +189,45 @@ class BlueprintsStorageModule(GameModule):
 	def iscenarios(self) -> Iterator[Tuple[str, dict]]:
 		return self.scenarios.__dict__.items()
 
+	# Names of every texture used by card and playspace blueprints, without duplicates
+	def textures(self) -> List[str]:
+		return list(dict.fromkeys(bp["texture"] for _, bp in itertools.chain(self.icards(), self.ibuildings())))
+
+	# Names of every texture a scenario can use. This is its construction site, starting and buildable buildings and the buildings those can transform into,
+	# plus the investment card, its drawable cards, and any cards its buildings can deal
+	def scenario_textures(self, scenario_id) -> List[str]:
+		scenario = self.get_scenario(scenario_id)
+		buildings = ["construction", *scenario["starting_buildings"], *scenario["buildable_buildings"]]
+		cards = ["investment", *scenario["drawable_cards"].keys()]
+
+		# Buildings list grows as transforms are found
+		for building in buildings:
+			data = self.get_building(building)["data"]
+			effect = data.get("play_effect", {})
+			for group in [effect.get("for_any", {}), effect.get("for_all", {}), *effect.get("for_card", {}).values()]:
+				cards.extend(group.get("dealcards", []))
+
+			for upgrade in data.get("upgrades", []):
+				if upgrade["effect_type"] == "transform" and upgrade["value"] not in buildings:
+					buildings.append(upgrade["value"])
+				elif upgrade["effect_type"] == "play_effect" and upgrade["value"][0] == "dealcards":
+					cards.extend(upgrade["value"][1])
+
+		textures = [self.get_building(b)["texture"] for b in buildings]
+		textures += [self.get_card(c)["texture"] for c in cards if self.get_card(c) is not None]
+		return list(dict.fromkeys(textures))
+
+	# Largest size each card and playspace texture is drawn at, as (mode, size) fits for the AssetManager
+	# Both are clipped to the top-left of their rect by the TextureClippingCacheModule, so nothing outside that region is ever seen
+	def texture_fits(self) -> Dict[str, Tuple[str, Tuple[int, int]]]:
+		sizes = {}
+		for blueprints, rect in [(self.icards(), consts.CARD_RECT), (self.ibuildings(), consts.BUILDING_RECT)]:
+			for _, bp in blueprints:
+				width, height = sizes.get(bp["texture"], (0, 0))
+				sizes[bp["texture"]] = (max(width, math.ceil(rect.width)), max(height, math.ceil(rect.height)))
+
+		return {name: ("crop", size) for name, size in sizes.items()}
+
 	# Fetch json based on card id
 	def get_card(self, name):
 		return self.cards.__dict__.get(name)
@@ -101,7 +256,10 @@ class CameraSpoofingModule(GameModule):
 		if game.input.key_down(pygame.K_d, pygame.K_RIGHT):
 			vel -= self.speed
 
-		for space in game.sprites.get("PLAYSPACE"):
+		if not vel:
+			return
+
+		for space in game.sprites.iterate("PLAYSPACE"):
 			space.rect.x += vel
 
 
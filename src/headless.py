@@ -0,0 +1,127 @@
+from prelude import *
+import time
+
+
+# Scripted player used when running headless (see main.py --headless)
+# It is the script of a ScriptedInputManager, which calls it once per tick. It clicks through the menus into the first scenario,
+# drags cards onto buildings that accept them, ends turns, and goes back to the main menu when the game is over
+class Autoplayer:
+	PLAYS_PER_TURN = 3
+	DRAG_TICKS = 30
+
+	def __init__(self, frames: int):
+		self.frames = frames
+		self.plays = 0
+		self.turns = 0
+		self.games = 0
+
+		self._inp = None
+		self._start = None
+		self._steps = self._play()
+
+	# Advance the script by one tick, and stop the game after the requested number of frames
+	def __call__(self, inp, tick: int):
+		if tick == 0:
+			self._start = time.perf_counter()
+
+		if tick >= self.frames:
+			game.loop.stop()
+			return
+
+		self._inp = inp
+		next(self._steps)
+
+	# Summary of the run for printing at exit
+	def report(self) -> str:
+		elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+		fps = self.frames / elapsed if elapsed else 0.0
+		return (
+			f"Headless run: {self.frames} frames in {elapsed:.2f}s ({fps:.1f} fps), "
+			f"{self.games} games, {self.turns} turns, {self.plays} cards played"
+		)
+
+	# Get a button by its text label, or None if there is no such button
+	def _find_button(self, text: str) -> Optional[Sprite]:
+		for sprite in game.sprites.iterate("UI"):
+			if getattr(sprite, "_text", None) == text:
+				return sprite
+		return None
+
+	def _wait(self, ticks: int):
+		for _ in range(ticks):
+			yield
+
+	# Wait for a button to appear, then click and release it
+	def _click(self, text: str, timeout: int = 600):
+		for _ in range(timeout):
+			button = self._find_button(text)
+			if button is not None:
+				break
+			yield
+		else:
+			logging.warning(f"Autoplayer gave up waiting for button '{text}'")
+			return
+
+		self._inp.set_mouse_pos(button.rect.center)
+		self._inp.set_mouse_buttons(left=True)
+		yield from self._wait(2)
+		self._inp.set_mouse_buttons()
+		yield from self._wait(2)
+
+	# Press the mouse at start, move it to end over a number of ticks and release it
+	def _drag(self, start: Vector2, end: Vector2):
+		self._inp.set_mouse_pos(start)
+		self._inp.set_mouse_buttons(left=True)
+		yield
+
+		for i in range(1, Autoplayer.DRAG_TICKS + 1):
+			self._inp.set_mouse_pos(Vector2(start).lerp(end, i / Autoplayer.DRAG_TICKS))
+			yield
+
+		self._inp.set_mouse_buttons()
+		yield
+
+	# Find a card in the hand and a building that will accept it
+	def _choose_play(self) -> Optional[Tuple[Sprite, Sprite]]:
+		for card in game.sprites.iterate("CARD"):
+			for space in game.sprites.iterate("PLAYSPACE"):
+				if space.card_validation(card):
+					return card, space
+		return None
+
+	def _play_turn(self):
+		for _ in range(Autoplayer.PLAYS_PER_TURN):
+			choice = self._choose_play()
+			if choice is None:
+				break
+
+			card, space = choice
+			yield from self._drag(card.rect.center, space.rect.center)
+			if card.is_destroyed():
+				self.plays += 1
+			yield from self._wait(20)
+
+		# Move the mouse away from the hand, end the turn and let the new cards be dealt
+		self._inp.set_mouse_pos((0, 0))
+		yield from self._click("End Turn")
+		self.turns += 1
+		yield from self._wait(90)
+
+	def _play(self):
+		while True:
+			yield from self._wait(10)
+			yield from self._click("PLAY")
+
+			_, scenario = next(iter(game.blueprints.iscenarios()))
+			yield from self._click(scenario["name"].upper())
+
+			# Wait for the transition into the game to finish
+			while self._find_button("End Turn") is None:
+				yield
+			self.games += 1
+
+			# The MENU button only appears on the game over screen
+			while self._find_button("MENU") is None:
+				yield from self._play_turn()
+
+			yield from self._click("MENU")
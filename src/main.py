@@ -4,10 +4,24 @@ import pygame.locals
 from pygame import Surface, Vector2, Rect, FRect, Color
 
 import os
+import sys
 import time
+import argparse
 from pprint import pprint, pformat
 import logging
 
+parser = argparse.ArgumentParser(description="TheWorks")
+parser.add_argument("--headless", action="store_true", help="Run without a display or audio device, playing scripted input as fast as possible")
+parser.add_argument("--frames", type=int, default=3000, help="Number of frames to run for when headless")
+parser.add_argument("--seed", type=int, default=None, help="Random seed, for repeatable headless runs")
+parser.add_argument("--profile", metavar="PATH", default=None, help="Time every module and sprite layer, and write percentiles to PATH on exit (F3 shows a frame-time graph)")
+args = parser.parse_args()
+
+# The dummy drivers have to be selected before pygame is initialised
+if args.headless:
+	os.environ["SDL_VIDEODRIVER"] = "dummy"
+	os.environ["SDL_AUDIODRIVER"] = "dummy"
+
 if os.path.exists("logs") and os.path.isdir("logs"):
 	logging.basicConfig(filename="logs/game.log", level=logging.DEBUG)
 else:
@@ -15,7 +29,6 @@ else:
 
 pygame.init()
 
-import sys
 import random
 import math
 import json
@@ -27,12 +40,15 @@ from typing import Dict, List, Optional
 
 from context import gamesystem
 from gamesystem import game, GameModule
-from gamesystem.mods.input import InputManagerScalingMouse
-from gamesystem.mods.window import ScalingWindowSystem, MultiLayerScreenSystem, WInfoModule, AspectScalingWindowSystem
+from gamesystem.mods.input import InputManagerScalingMouse, ScriptedInputManager
+from gamesystem.mods.window import ScalingWindowSystem, MultiLayerScreenSystem, WInfoModule, AspectScalingWindowSystem, HeadlessWindowSystem
 from gamesystem.mods.defaults import SpritesManager, StateManager, GameloopManager, ClockManager
 from gamesystem.mods.debug import DebugOverlayManager
 from gamesystem.mods.assets import AssetManager
-from gamesystem.mods.audio import AudioManagerNumChannels
+from gamesystem.mods.audio import VoicePoolAudioManager, NullAudioManager, SoundSettings
+from gamesystem.mods.spatial import SpatialHashModule
+from gamesystem.mods.transform import TransformCacheModule
+from gamesystem.mods.profiler import ProfilerModule
 
 from gamesystem.common.sprite import Sprite, SpriteGroup
 from gamesystem.common.assets import SpriteSheet
@@ -43,16 +59,18 @@ from playspaces import Playspace
 
 from gameutil import ScalingImageSprite, HookSprite, BoxesTransition, ImageSprite, Promise
 from consts import VZERO
+import consts
 
-from gmods import TextureClippingCacheModule, BlueprintsStorageModule, PlayerStateTrackingModule, CardSpawningModule, CameraSpoofingModule
+from gmods import TextureClippingCacheModule, PrerenderCacheModule, BlueprintsStorageModule, PlayerStateTrackingModule, CardSpawningModule, CameraSpoofingModule
 import fonts
 import palette
 
 import requests
 
-from tooltip import Tooltip
-from ui import AbstractButton, NamedButton, ProgressBar, TargettingProgressBar, DodgingProgressBar, UserDebugLog
+from tooltip import Tooltip, TooltipManager
+from ui import AbstractButton, NamedButton, ProgressBar, TargettingProgressBar, DodgingProgressBar, UserDebugLog, UIDispatcher
 from turntaking import PlayerTurnTakingModule
+from headless import Autoplayer
 
 
 # Create a boxes transition and change to a new gameloop halfway through
@@ -60,8 +78,24 @@ def boxes_loop_transition(loop):
 	return lambda: game.sprites.new(BoxesTransition(game.windowsystem.rect.copy(), (16, 9), callback = lambda: game.loop.run(loop)))
 
 
+TUTORIAL_TEXTURES = [f"tutorial{i}" for i in range(1, 8)]
+
+
+# Box the tutorial is drawn in
+def tutorial_rect() -> Rect:
+	return game.windowsystem.rect.inflate(-300, -300).move(0, -100)
+
+
+# Area within the tutorial box that slides are scaled to the height of
+def tutorial_image_space(rect: Rect) -> Rect:
+	image_space = rect.inflate(-100, -200)
+	image_space.topleft -= Vector2(0, 50)
+	return image_space
+
+
 # Setup menu, with a slideshow, text, and buttons
 def tutorial_menu():
+	game.assets.enter_scene("tutorial", ["citiedlow1", *TUTORIAL_TEXTURES])
 	game.sprites.purge_preserve("TRANSITION")
 	game.sprites.new(ScalingImageSprite(VZERO, game.assets.citiedlow1), layer_override="BACKGROUND")
 
@@ -86,14 +120,16 @@ def tutorial_menu():
 				game.sprites.new(self._menu_button)
 				self._menu_button = None
 
+		def draw_state(self):
+			return (self.rect, len(self._text_images))
+
 		def update_draw(self):
 			if self._text_images:
 				pygame.draw.rect(game.windowsystem.screen, palette.BLACK, self.rect, border_radius=5)
-				image_space = self.rect.inflate(-100, -200)
-				image_space.topleft -= Vector2(0, 50)
+				image_space = tutorial_image_space(self.rect)
 				text, img = self._text_images[0]
 				ratio = image_space.height / img.get_height()
-				trans = pygame.transform.scale_by(img, (ratio, ratio))
+				trans = game.transforms.scale_by(img, ratio)
 				image_space.x = image_space.centerx - trans.get_width()/2
 
 				game.windowsystem.screen.blit(trans, image_space.topleft)
@@ -101,12 +137,11 @@ def tutorial_menu():
 				img_rect.topleft = image_space.topleft
 				pygame.draw.rect(game.windowsystem.screen, palette.WHITE, img_rect, width=3, border_radius=5)
 
-				font = fonts.families.roboto.size(28)
-				textrend = font.render(text, True, palette.TEXT)
+				textrend = fonts.families.roboto.render(text, 28, True, palette.TEXT)
 				game.windowsystem.screen.blit(textrend, self.rect.midbottom - Vector2(textrend.get_width()/2, textrend.get_height()*3))
 
 	# Tutorial texts and accompanying images
-	game.sprites.new(Tutorial(game.windowsystem.rect.inflate(-300, -300).move(0, -100), [
+	game.sprites.new(Tutorial(tutorial_rect(), [
 		("Welcome to The Works. In this game, you must play cards onto the correct buildings", game.assets.tutorial1),
 		("Cards are dealt into your hand at the start of every turn. Mouse over them to learn more about them", game.assets.tutorial2),
 		("Buildings have limited capacity, and you cannot play more cards than their capacity per turn", game.assets.tutorial3),
@@ -119,12 +154,16 @@ def tutorial_menu():
 
 # Main menu with the game logo and buttons to different gameloops
 def main_menu():
+	game.assets.enter_scene("menu", ["citiedlow1", "logo"])
 	game.sprites.purge_preserve("TRANSITION")
 	game.sprites.new(ScalingImageSprite(VZERO, game.assets.citiedlow1), layer_override="BACKGROUND")
 
 	def start_game():
 		game.loop.run(scenario_choice)
 
+	# The scenario menu or the tutorial are next
+	game.assets.prefetch("scenarios", *TUTORIAL_TEXTURES)
+
 	game.sprites.new(NamedButton(FRect(150, 500, 200, 100), "PLAY", onclick = start_game))
 	game.sprites.new(NamedButton(FRect(400, 500, 200, 100), "TUTORIAL", onclick = boxes_loop_transition(tutorial_menu)))
 	game.sprites.new(NamedButton(FRect(650, 500, 200, 100), "EXIT", onclick = lambda: game.sprites.new(BoxesTransition(game.windowsystem.rect.copy(), (16, 9), callback = game.loop.stop))))
@@ -134,6 +173,7 @@ def main_menu():
 
 # Game menu for choosing which scenario you want to play
 def scenario_choice():
+	game.assets.enter_scene("scenarios", ["citiedlow1", "scenarios"])
 	game.sprites.purge_preserve("TRANSITION", "BACKGROUND")
 	game.sprites.new(ScalingImageSprite(VZERO, game.assets.citiedlow1), layer_override="BACKGROUND")
 
@@ -141,6 +181,9 @@ def scenario_choice():
 		game.playerturn.set_scenario_id(scenario_id)
 		game.sprites.new(BoxesTransition(game.windowsystem.rect.copy(), (16, 9), callback = lambda: game.loop.run(mainloop)))
 
+	# The cards and buildings are needed as soon as a scenario starts
+	game.assets.prefetch(*game.blueprints.textures())
+
 	# Scenario logo
 	game.sprites.new(ImageSprite(Vector2(200, 150), game.assets.scenarios), layer_override="FOREGROUND")
 	button_start = FRect(200, 400, 500, 100)
@@ -149,9 +192,8 @@ def scenario_choice():
 	for scen_id, scenario in game.blueprints.iscenarios():
 		scenario_start = NamedButton(button_start.copy(), scenario["name"].upper(), onclick = functools.partial(start_game, scen_id))
 		game.sprites.new(scenario_start)
-		tooltip = Tooltip(scenario["name"], scenario["description"], scenario_start.rect, parent = scenario_start)
+		tooltip = game.tooltips.new(scenario["name"], scenario["description"], scenario_start.rect, parent = scenario_start)
 		tooltip.z = 2
-		game.sprites.new(tooltip)
 		button_start.topleft += Vector2(0, 150)
 
 	button_start.width = 200
@@ -160,6 +202,11 @@ def scenario_choice():
 
 # Gameplay loop
 def mainloop():
+	# Only the textures the chosen scenario can use stay loaded
+	scenario_id = game.playerturn.scenario.scenario_id
+	game.assets.enter_scene(f"scenario:{scenario_id}", ["citiedlow1", *game.blueprints.scenario_textures(scenario_id)])
+	logging.debug(f"Resident textures: {game.assets.resident_bytes()} bytes")
+
 	game.playerstate.reset()
 	game.sprites.purge_preserve("TRANSITION")
 	game.sprites.new(ScalingImageSprite(VZERO, game.assets.citiedlow1), layer_override="BACKGROUND")
@@ -203,70 +250,151 @@ def mainloop():
 	logging.debug("-------------------- GAME START --------------------\n\n")
 
 
-# Uodate certain modules every frame
-def do_running(self):
-	self.game.clock.update()
+# Update the game logic once per fixed length tick
+def do_tick(self):
 	self.game.state.update()
 	self.game.input.update()
+	self.game.ui.update()
 	self.game.camera.update()
-	self.game.sprites.update()
+	self.game.sprites.update_move()
 	self.game.playerstate.update()
+	self.game.audio.update()
+
+
+# Render once per frame (frames may be skipped when the logic falls behind)
+def do_draw(self):
+	self.game.windowsystem.begin_draw()
+	self.game.sprites.update_draw()
 	self.game.debug.update()
 	self.game.windowsystem.update()
 
+	if args.profile:
+		self.game.profiler.update()
+
 
 # Add all modules on program start
 if __name__ == "__main__":
 	# Sprites handler manages all the gameobjects in the game and sorts them into layers and Z axises
+	# The foreground and UI layers rarely change, so they are retained: composited once and only redrawn where a sprite's draw_state changes
 	game.add_module(
-		SpritesManager, layers=["MANAGER", "BACKGROUND", "LOWPARTICLE", "PLAYSPACE", "CARD", "PARTICLE", "FONT", "FOREGROUND", "UI", "TRANSITION"]
+		SpritesManager,
+		layers=["MANAGER", "BACKGROUND", "LOWPARTICLE", "PLAYSPACE", "CARD", "PARTICLE", "FONT", "FOREGROUND", "UI", "TRANSITION"],
+		retained=["FOREGROUND", "UI"]
 	)
 
-	# GameloopManager updates the game every frame
-	game.add_module(GameloopManager, loop_hook=do_running)
+	# Spatial index over the layers that are hit-tested against each other every frame (cards and buildings)
+	game.add_module(SpatialHashModule, layers=["PLAYSPACE", "CARD"])
+
+	# Tooltips are hit-tested together once per frame, and only rendered when first shown
+	game.add_module(TooltipManager)
+
+	# Scaled Surfaces are memoized, so backgrounds, tutorial slides and despawning cards are only scaled once per size
+	game.add_module(TransformCacheModule)
+
+	# GameloopManager runs the game logic at a fixed 60 ticks per second and renders in between
+	game.add_module(GameloopManager, loop_hook=do_tick, draw_hook=do_draw)
 	game.add_module(StateManager)
-	game.add_module(ClockManager)
+	if args.headless:
+		# Headless runs are uncapped and run exactly one tick per frame so they are repeatable
+		game.add_module(ClockManager, framerate=0, tick_rate=0)
+	else:
+		game.add_module(ClockManager, framerate=60, tick_rate=60)
 
 	game.add_module(WInfoModule)
 
-	# ScalingWindowSystem creates a window and an internal buffer that scales to the window size
-	game.add_module(
-		ScalingWindowSystem,
-		size=game.winfo.display_size,
-		user_size=game.winfo.display_size,
-		caption="TheWorks",
-		flags=pygame.NOFRAME,
-		fill_color=Color("#000000")
-	)
-
-	# InputManagerScalingMouse manages game input (keyboard, mouse)
-	game.add_module(InputManagerScalingMouse)
+	if args.headless:
+		random.seed(args.seed)
+		autoplayer = Autoplayer(args.frames)
+
+		# Hidden window under the dummy video driver, which still renders every frame the same way as a real window
+		game.add_module(
+			HeadlessWindowSystem, size=game.winfo.display_size, caption="TheWorks", fill_color=Color("#000000"), dirty_rects=True
+		)
+
+		# ScriptedInputManager takes its input from the Autoplayer instead of the mouse and keyboard
+		game.add_module(ScriptedInputManager, script=autoplayer)
+
+	else:
+		# ScalingWindowSystem creates a window and an internal buffer that scales to the window size
+		# In dirty rect mode only the regions where sprites changed are redrawn and presented each frame
+		game.add_module(
+			ScalingWindowSystem,
+			size=game.winfo.display_size,
+			user_size=game.winfo.display_size,
+			caption="TheWorks",
+			flags=pygame.NOFRAME,
+			fill_color=Color("#000000"),
+			dirty_rects=True
+		)
+
+		# InputManagerScalingMouse manages game input (keyboard, mouse)
+		game.add_module(InputManagerScalingMouse)
 	game.add_module(DebugOverlayManager, fontcolour=Color("#ff00ff"))
 
+	# Buttons and menus are picked in a single pass per tick, so only the topmost widget under the mouse is hovered or clicked
+	game.add_module(UIDispatcher)
+
+
+	# Create the BlueprintsStorageModule based on the data/blueprints.json file, which defines all the game data
+	with open("data/blueprints.json") as file:
+		game.add_module(BlueprintsStorageModule, blueprints=json.load(file))
+
+	# Textures are shrunk as they load to the largest size they are drawn at. Card and playspace textures are clipped to their rects,
+	# the background is stretched to the screen, and tutorial slides are scaled to the height of the tutorial's image space
+	screen_size = (game.windowsystem.rect.width, game.windowsystem.rect.height)
+	texture_fits = game.blueprints.texture_fits()
+	texture_fits["citiedlow1"] = ("stretch", screen_size)
+	texture_fits.update({name: ("fit", (screen_size[0], max(1, tutorial_image_space(tutorial_rect()).height))) for name in TUTORIAL_TEXTURES})
 
 	# Load the data/assets.json file and create modules based on its contents
 	with open("data/assets.json") as file:
 		jdict = json.load(file)
 		textures, sfx = jdict["textures"], jdict["sfx"]
 
-		# Load all textures defined in the json
-		game.add_module(AssetManager, assets=textures)
-
-		# Load all audio files defined in the json
-		game.add_module(AudioManagerNumChannels, sounds=sfx, num_channels=30)
-
-	# Create the BlueprintsStorageModule based on the data/blueprints.json file, which defines all the game data
-	with open("data/blueprints.json") as file:
-		game.add_module(BlueprintsStorageModule, blueprints=json.load(file))
+		# Textures defined in the json are decoded in the background when a scene needs them, and evicted when no scene does
+		# If the bundle has been built (make bundle) the textures in it are used without decoding the images
+		game.add_module(AssetManager, assets=textures, lazy=True, preload=False, bundle=consts.BUNDLE_PATH, fit=texture_fits)
+
+		# Sounds defined in the json are decoded the first time they play, and share a fixed pool of voices. Music is streamed from disk
+		# (or stand in for them all when there is no audio device)
+		# Unplayed cards all pollute at the end of a turn, so that sound is limited to a few voices at once. It and card_switch, which fires on every reorder
+		# while a card is dragged across the hand, are the only sounds that come in bursts, so only they are coalesced
+		sound_settings = {
+			"polluting": SoundSettings(max_voices=3, coalesce_ms=60),
+			"card_switch": SoundSettings(max_voices=2, coalesce_ms=40),
+			"dispose": SoundSettings(priority=1),
+			"button": SoundSettings(priority=2, max_voices=1),
+			"err": SoundSettings(priority=2, max_voices=1),
+		}
+		if args.headless:
+			game.add_module(NullAudioManager, sounds=sfx)
+		else:
+			game.add_module(VoicePoolAudioManager, sounds=sfx, num_voices=16, settings=sound_settings, music=jdict.get("music", {}))
 
 	# Add misc custom modules
 	game.add_module(CardSpawningModule)
 	game.add_module(TextureClippingCacheModule)
+	game.add_module(PrerenderCacheModule)
 	game.add_module(PlayerStateTrackingModule)
 	game.add_module(PlayerTurnTakingModule)
 	game.add_module(CameraSpoofingModule)
 
+	# Wrap module updates and sprite layer passes with timers when profiling
+	if args.profile:
+		game.add_module(ProfilerModule, dump_path=args.profile)
+		# Every module with a per-frame update, apart from those wrapped under their own labels below
+		# spriteglobals runs inside sprites.move, and keeps sprite aliases in its attributes so it cannot be wrapped
+		game.profiler.wrap_modules(exclude=("sprites", "windowsystem", "spriteglobals"))
+		game.profiler.wrap(game.sprites, "update_move", "sprites.move")
+		game.profiler.wrap(game.sprites, "update_draw", "sprites.draw")
+		game.profiler.wrap(game.windowsystem, "begin_draw", "windowsystem.begin_draw")
+		game.profiler.wrap(game.windowsystem, "update", "windowsystem")
+		game.profiler.wrap_layers()
+
 	game.loop.functions = SimpleNamespace(gameplay=mainloop, menu=main_menu)
 
 	# Run the game's entrypoint loop function
 	game.loop.run(main_menu)
+
+	if args.headless:
+		print(autoplayer.report())
@@ -1,4 +1,5 @@
 from prelude import *
+import numpy as np
 
 
 # Simple particle type. Spawns, floats off in a direction, and diminishes
@@ -28,6 +29,9 @@ class Particle(Sprite):
 	def update_draw(self):
 		pygame.draw.circle(game.windowsystem.screen, self.colour, self.pos, self.size)
 
+	def draw_state(self):
+		return (FRect(self.pos - Vector2(self.size, self.size), (self.size * 2, self.size * 2)), self.size)
+
 
 # Particle that renders a Surface
 class SurfaceParticle(Particle):
@@ -35,11 +39,13 @@ class SurfaceParticle(Particle):
 	def __init__(self, pos, vel, surface, lifetime=60):
 		super().__init__(pos, surface.get_width() / 2, vel, Color("#ff00ff"), lifetime)
 		self.surface = surface
+		self._source = surface
 		self._start_size = Vector2(self.surface.get_size())
 
+	# Always scale from the original Surface, so particles sharing it share the scaled Surfaces too
 	def update_draw(self):
 		scale_to = Vector2(self.size, self.size) * 2
-		self.surface = pygame.transform.scale(self.surface, scale_to)
+		self.surface = game.transforms.scale(self._source, scale_to)
 
 		game.windowsystem.screen.blit(self.surface, self.pos - Vector2(self.surface.get_size()) / 2)
 
@@ -60,9 +66,169 @@ class DeflatingParticle(Particle):
 	def update_draw(self):
 		pygame.draw.rect(game.windowsystem.screen, self.colour, self.rect, border_radius=5)
 
+	def draw_state(self):
+		return (self.rect, None)
+
+
+# Struct-of-arrays particle engine for large numbers of simple round particles
+# Positions, velocities, sizes, decay rates and colours are stored in NumPy arrays and updated in one vectorized step per frame.
+# Particles are drawn with a single Surface.blits call, using circle surfaces cached by colour and radius, which is several times faster than a draw.circle call per particle
+class ParticleField(Sprite):
+	LAYER = "PARTICLE"
+	START_CAPACITY = 256
+
+	def __init__(self, outline: int = 0):
+		self.outline = outline  # If above 0, every particle also gets a lighter outline this many pixels wide
+
+		self._count = 0
+		self._pos = np.zeros((ParticleField.START_CAPACITY, 2), dtype=np.float32)
+		self._vel = np.zeros((ParticleField.START_CAPACITY, 2), dtype=np.float32)
+		self._size = np.zeros(ParticleField.START_CAPACITY, dtype=np.float32)
+		self._decay = np.zeros(ParticleField.START_CAPACITY, dtype=np.float32)
+		self._colour = np.zeros(ParticleField.START_CAPACITY, dtype=np.int32)
+
+		self._colours: List[Tuple[Color, Color]] = []  # Palette of (fill, outline) colours, indexed by self._colour
+		self._colour_idx: Dict[Tuple[int, int, int, int], int] = {}
+		self._circles: Dict[Tuple[int, int, int], Surface] = {}
+		self._ticks = 0
+
+	def __len__(self):
+		return self._count
+
+	# Get the palette index of a colour, adding it if needed
+	def _colour_index(self, colour) -> int:
+		colour = Color(colour)
+		key = tuple(colour)
+		idx = self._colour_idx.get(key)
+		if idx is None:
+			idx = self._colour_idx[key] = len(self._colours)
+			self._colours.append((colour, colour.lerp(Color("#ffffff"), 0.5)))
+		return idx
+
+	# Make room for n more particles, doubling the arrays as needed
+	def _reserve(self, n: int):
+		needed = self._count + n
+		capacity = len(self._size)
+		if needed <= capacity:
+			return
+
+		while capacity < needed:
+			capacity *= 2
+
+		def grow(arr):
+			new = np.zeros((capacity, *arr.shape[1:]), dtype=arr.dtype)
+			new[:self._count] = arr[:self._count]
+			return new
+
+		self._pos, self._vel = grow(self._pos), grow(self._vel)
+		self._size, self._decay, self._colour = grow(self._size), grow(self._decay), grow(self._colour)
+
+	# Add particles. pos and vel are (n, 2) arrays, size and lifetime are (n,) arrays or single values
+	def emit(self, pos, vel, size, colour, lifetime):
+		vel = np.asarray(vel, dtype=np.float32).reshape(-1, 2)
+		n = len(vel)
+		self._reserve(n)
+
+		i, j = self._count, self._count + n
+		self._pos[i:j] = np.asarray(pos, dtype=np.float32).reshape(-1, 2)
+		self._vel[i:j] = vel
+		self._size[i:j] = size
+		self._decay[i:j] = self._size[i:j] / np.asarray(lifetime, dtype=np.float32)
+		self._colour[i:j] = self._colour_index(colour)
+		self._count = j
+
+	# Add particles flying away from a point at random angles, with the same randomness as particle_explosion
+	def explosion(self, number: int, pos, size, colour, speed=None, lifetime=None):
+		angles = np.random.uniform(0, math.tau, number)
+		speeds = np.random.randint(3, 11, number) if speed is None else speed * np.random.uniform(0.6, 1.4, number)
+		lifetimes = np.random.randint(40, 71, number) if lifetime is None else lifetime * np.random.uniform(0.6, 1.4, number)
+
+		vel = np.stack((np.cos(angles), np.sin(angles)), axis=1) * speeds[:, None]
+		self.emit(np.broadcast_to(np.asarray(pos, dtype=np.float32), (number, 2)), vel, size, colour, lifetimes)
+
+	def clear(self):
+		self._count = 0
+
+	# Move and shrink every particle, then drop the ones that have shrunk away
+	def update_move(self):
+		n = self._count
+		if not n:
+			return
+
+		self._ticks += 1
+		self._pos[:n] += self._vel[:n]
+		self._size[:n] -= self._decay[:n]
+
+		alive = self._size[:n] >= 1
+		if not alive.all():
+			k = int(alive.sum())
+			for arr in (self._pos, self._vel, self._size, self._decay, self._colour):
+				arr[:k] = arr[:n][alive]
+			self._count = k
+
+	# Get a cached surface with a circle of the given palette colour and radius
+	def _circle(self, colour_idx: int, radius: int, outline: bool) -> Surface:
+		key = (colour_idx, radius, outline)
+		surf = self._circles.get(key)
+		if surf is None:
+			# Colorkeyed RLE surfaces blit much faster than per-pixel alpha ones. The inverted colour can never clash with the fill
+			colour = self._colours[colour_idx][outline]
+			colourkey = Color(255 - colour.r, 255 - colour.g, 255 - colour.b)
+
+			surf = Surface((radius * 2, radius * 2))
+			surf.fill(colourkey)
+			pygame.draw.circle(surf, colour, (radius, radius), radius)
+			surf.set_colorkey(colourkey, pygame.RLEACCEL)
+			self._circles[key] = surf
+		return surf
+
+	def _blit_circles(self, radii, outline: bool):
+		n = self._count
+		topleft = (self._pos[:n] - radii[:, None]).astype(np.int32).tolist()
+
+		# Look up each distinct (colour, radius) surface once, then index into them for every particle
+		keys, inverse = np.unique(self._colour[:n].astype(np.int64) << 32 | radii, return_inverse=True)
+		circles = [self._circle(int(k >> 32), int(k & 0xffffffff), outline) for k in keys]
+		game.windowsystem.screen.blits(zip([circles[i] for i in inverse.tolist()], topleft), doreturn=False)
+
+	def update_draw(self):
+		if not self._count:
+			return
+
+		radii = self._size[:self._count].astype(np.int32)
+		if self.outline:
+			self._blit_circles(radii + self.outline, outline=True)
+		self._blit_circles(radii, outline=False)
+
+	def draw_state(self):
+		n = self._count
+		if not n:
+			return (FRect(0, 0, 0, 0), None)
+
+		reach = self._size[:n, None] + self.outline
+		low = (self._pos[:n] - reach).min(axis=0)
+		high = (self._pos[:n] + reach).max(axis=0)
+		return (FRect(float(low[0]), float(low[1]), float(high[0] - low[0]), float(high[1] - low[1])), self._ticks)
+
+
+# Get the ParticleField for the current scene, creating it if the last one was purged
+def particle_field() -> ParticleField:
+	field = getattr(game.spriteglobals, "particle_field", None)
+	if field is None or field.is_destroyed():
+		field = ParticleField()
+		game.sprites.new(field)
+		game.spriteglobals.particle_field = field
+	return field
+
 
 # Spawn many particles at once at a random spread
+# Plain Particles are added straight to the scene's ParticleField (so nothing is returned for them), other particle types are returned as sprites
 def particle_explosion(number, *args, particle_type=Particle, **kwargs) -> List[Particle]:
+	if particle_type is Particle:
+		pos, size = args
+		particle_field().explosion(number, pos, size, **kwargs)
+		return []
+
 	parts = []
 	for _ in range(number):
 		if kwargs.get("speed"):
@@ -80,43 +246,32 @@ def particle_explosion(number, *args, particle_type=Particle, **kwargs) -> List[
 	return parts
 
 
-# Class that manages a series of Particles and constantly emits and destroys them (not used in final game)
-class BubbleParticleEmitter(SpriteGroup):
+# Sprite that constantly emits bubble particles from a point, drawn with outlines (not used in final game)
+class BubbleParticleEmitter(Sprite):
 	LAYER = "BACKGROUND"
 
 	def __init__(self, pos=Vector2(0, 0), colours=["#923efc", "#6e1698"], mouse_follow=False):
-		super().__init__()
-
 		self.pos = pos
 		colours = list(map(Color, colours))
 		self.c1, self.c2 = colours
 		self.mouse_follow = mouse_follow
+		self.field = ParticleField(outline=6)
 
 	def update_move(self):
 		a = random.randint(0, 180)
 		vel = Vector2(math.cos(a), math.sin(a))
-
 		c = self.c1.lerp(self.c2, random.uniform(0.0, 1.0))
-		part = Particle(
-			Vector2(self.pos),
-			95,
-			vel,
-			c,
-			lifetime=1120 + random.randint(-50, 50),
-		)
 
 		if self.mouse_follow:
 			self.pos = game.input.mouse_pos()
-			if game.input.mouse_down(0):
-				self.sprites.append(part)
-		else:
-			self.sprites.append(part)
 
-		super().update_move()
+		if not self.mouse_follow or game.input.mouse_down(0):
+			self.field.emit(self.pos, vel, 95, c, lifetime=1120 + random.randint(-50, 50))
+
+		self.field.update_move()
 
 	def update_draw(self):
-		for part in reversed(self.sprites):
-			pygame.draw.circle(game.windowsystem.screen, part.outline, part.pos, part.size + 6)
+		self.field.update_draw()
 
-		for part in reversed(self.sprites):
-			pygame.draw.circle(game.windowsystem.screen, part.colour, part.pos, part.size)
+	def draw_state(self):
+		return self.field.draw_state()
@@ -6,6 +6,7 @@ from dataclasses import field
 import copy
 from ui import Dropdown, NamedButton, AbstractButton, Onclick
 from particles import DeflatingParticle
+import fonts
 
 
 # An Effect that is triggered when a Card is played to a Playspace
@@ -158,9 +159,10 @@ class Playspace(Sprite):
 	MAX_DRAG_FRAMES = 10
 	DROPDOWN_BUTTON_DIMS = Vector2(30, 50)
 
-	def __init__(self, rect, surface, data):
+	def __init__(self, rect, surface, data, picture: Optional[str] = None):
 		self.rect = rect
 		self.data = data
+		self._picture = picture  # Name of the texture, if it came from a blueprint
 
 		# Speical case where the Consntruction type's upgrades need to match the availible buildings for the current scenario
 		if self.data.space_id == "construction":
@@ -186,22 +188,12 @@ class Playspace(Sprite):
 		self._dragged_frames = 0
 		self._dragged_poe = None
 
-		texture = surface.copy()
-		titlesurf = Surface(self.titlebar.size, pygame.SRCALPHA)
-		titlesurf.fill(palette.BLACK)
-		texture.blit(titlesurf, VZERO)
-
-		# Create the Playspace's Surface that will be used to render it
-		self.surface = game.textclip.get_or_insert(texture, rect.size)
-		self.surface = surface_rounded_corners(self.surface, 5)
-		pygame.draw.rect(self.surface, palette.BLACK, Rect(VZERO, self.rect.size), width=5, border_radius=5)
-
-		self._overlay_surface = Surface(rect.size, pygame.SRCALPHA)
-		self._overlay_surface.fill(palette.BLACK)
-		self._overlay_surface = surface_rounded_corners(self._overlay_surface, 5)
-		self._overlay_surface.set_alpha(127)
-
-		self._shadow = shadow_from_rect(self.surface.get_rect(), border_radius=5)
+		# Every Playspace with the same texture and size shares the same Surfaces. mutable_surface gives this Playspace its own copy to draw onto
+		# The render only depends on those, and space_id cannot be used as several buildings share one (and it is not always a string)
+		self.surface, self._overlay_surface, self._shadow = game.prerender.get_or_render(
+			("playspace", self._picture, int(rect.width), int(rect.height)), surface, lambda: self._render_surfaces(surface)
+		)
+		self._surface_shared = True
 		self._investments = 0
 		self._stamina = self.data.stamina
 
@@ -211,6 +203,32 @@ class Playspace(Sprite):
 			dropdown_rect, UpgradeMenu.from_playspace(self).set_pos(dropdown_pos + vec(dropdown_rect.width, 0))
 		)
 		self._upgrade_button.rect.topleft = dropdown_pos
+		self._upgrade_button.ui_parent = self  # Picked at the Playspace's layer and z, as the Playspace draws it
+
+	# Create the Playspace's image, the overlay drawn when a card hovers it, and its shadow
+	def _render_surfaces(self, surface: Surface) -> Tuple[Surface, Surface, Surface]:
+		# Clip the texture through the cache first, so only the clipped region is copied to draw the titlebar on
+		texture = game.textclip.get_or_insert(surface, self.rect.size).copy()
+		titlesurf = Surface(self.titlebar.size, pygame.SRCALPHA)
+		titlesurf.fill(palette.BLACK)
+		texture.blit(titlesurf, VZERO)
+
+		image = surface_rounded_corners(texture, 5)
+		pygame.draw.rect(image, palette.BLACK, Rect(VZERO, self.rect.size), width=5, border_radius=5)
+
+		overlay = Surface(self.rect.size, pygame.SRCALPHA)
+		overlay.fill(palette.BLACK)
+		overlay = surface_rounded_corners(overlay, 5)
+		overlay.set_alpha(127)
+
+		return image, overlay, shadow_from_rect(image.get_rect(), border_radius=5)
+
+	# Get the Playspace's Surface to draw onto, copying it first if it is still shared with other Playspaces
+	def mutable_surface(self) -> Surface:
+		if self._surface_shared:
+			self.surface = self.surface.copy()
+			self._surface_shared = False
+		return self.surface
 
 	# Create a Playspace based on json data
 	@classmethod
@@ -220,17 +238,14 @@ class Playspace(Sprite):
 		texture = game.assets.get(blueprint["texture"])
 
 		dest = Playspace._find_availible_space(consts.BUILDING_RECT.copy())
-		ret = cls(dest, texture, data)
-		ret._picture = blueprint["texture"]
-
-		return ret
+		return cls(dest, texture, data, blueprint["texture"])
 
 	# Find empty space on the screen where the Playspace can be placed
 	@staticmethod
 	def _find_availible_space(rect):
 
 		def check():
-			return any(space.rect.colliderect(rect) for space in game.sprites.get("PLAYSPACE"))
+			return game.spatial.any("PLAYSPACE", rect)
 
 		while check() and rect.right < game.windowsystem.dimensions.x:
 			rect.x += consts.CARD_RECT.width * 1.1
@@ -244,7 +259,7 @@ class Playspace(Sprite):
 
 	# Spawn an accompanying tooltip for the Playspace
 	def with_tooltip(self):
-		game.sprites.new(Tooltip(self.data.title, self.data.description, self.rect, parent=self))
+		game.tooltips.new(self.data.title, self.data.description, self.rect, parent=self)
 		return self
 
 	# Add an upgrade point to the Playspace
@@ -287,14 +302,11 @@ class Playspace(Sprite):
 
 	# Is there a card hovering above the Playspace this frame
 	def card_hovering(self, card) -> bool:
-		return self.rect.colliderect(card.rect.inflate(-card.PLAYABLE_OVERLAP, -card.PLAYABLE_OVERLAP))
+		return self.rect.colliderect(card.hover_rect())
 
-	# Is there a card hovering above this Playspace exclusively
+	# Is there a card hovering above this Playspace exclusively (the first Playspace under the card is this one)
 	def card_hovering_exclude(self, card) -> bool:
-		for space in game.sprites.get("PLAYSPACE"):
-			if space.card_hovering(card):
-				return space is self
-		return False
+		return game.spatial.first("PLAYSPACE", card.hover_rect()) is self
 
 	# Collide with a given card to see if it is within play range, and will also be accepted
 	def collidecard(self, card) -> bool:
@@ -305,9 +317,9 @@ class Playspace(Sprite):
 	# If the Playspace is dragged somewhere invalid and dropped. Returns True if placement is invalid, playspace will return to initial position before dragging begun
 	def _invalid_placement(self) -> bool:
 		return any(
-			self.collidecard(card) for card in game.sprites.get("CARD")
-		) or self.rect.bottom > game.windowsystem.dimensions.y - CARD_RECT.height or any(
-			self.rect.colliderect(space.rect) for space in game.sprites.get("PLAYSPACE") if space is not self
+			self.collidecard(card) for card in game.spatial.query("CARD", self.rect)
+		) or self.rect.bottom > game.windowsystem.dimensions.y - CARD_RECT.height or game.spatial.any(
+			"PLAYSPACE", self.rect, exclude=self
 		) or self.rect.y < 0
 
 	def _drop_drag(self):
@@ -360,6 +372,33 @@ class Playspace(Sprite):
 		else:
 			self.z = 0
 
+	# Is any card hovering over this Playspace exclusively
+	def _card_over(self) -> bool:
+		return any(self.card_hovering_exclude(card) for card in game.spatial.query("CARD", self.rect))
+
+	def draw_state(self):
+		hover = min(Playspace.MAX_DRAG_FRAMES, self._dragged_frames)
+		region = self.rect.union(self.rect.move(-hover, -hover))
+		dropped = self._upgrade_button.is_down()
+		buttons = self._upgrade_button.elements.buttons
+
+		if dropped:
+			region = region.union(self._upgrade_button.elements.rect)
+			for button in buttons:
+				if button._tooltip.visible():
+					region = region.union(button._tooltip.rect)
+
+		# Buttons and tooltips inside the Playspace react to the mouse, so any mouse activity over it counts as a change
+		local_input = None
+		if game.input.mouse_within(region):
+			local_input = (
+				tuple(game.input.mouse_pos()),
+				game.input.mouse.LEFT,
+				tuple(button._tooltip.visible() for button in buttons) if dropped else ()
+			)
+
+		return (region, (hover, self._card_over(), self._stamina, self._investments, dropped, self.z, local_input))
+
 	# Render the Playspace
 	def update_draw(self):
 		if self._dragged_frames > 0:
@@ -373,7 +412,7 @@ class Playspace(Sprite):
 		game.windowsystem.screen.blit(self.surface, bpos)
 
 		# Draw an overaly on top of the Playspace if a card is hovering it exclusively
-		if any(self.card_hovering_exclude(card) for card in game.sprites.get("CARD")):
+		if self._card_over():
 			game.windowsystem.screen.blit(self._overlay_surface, self.rect.topleft)
 
 			ov_rect = self.rect.copy()
@@ -477,7 +516,7 @@ class UpgradeButton(NamedButton):
 						0) if not self.upgrade.can_apply(self.space) and self.mouse_down_over() else palette.WHITE
 			pygame.draw.rect(game.windowsystem.screen, clr, upgrade_pip_rect, border_radius=5)
 
-			cost_render = self._font.render(str(self.upgrade.cost), True, clr)
+			cost_render = fonts.families.roboto.render(str(self.upgrade.cost), self._font_size, True, clr)
 			game.windowsystem.screen.blit(
 				cost_render, rect.midright - Vector2(50, 0) - Vector2(cost_render.get_size()) / 2
 			)
@@ -494,11 +533,13 @@ class UpgradeMenu(Sprite):
 	def __init__(self, rect: FRect, buttons: List[Sprite]):
 		self.rect = rect
 		self.buttons = buttons
+		self.ui_parent = None
 
 		rectw, recth = UpgradeMenu.PADDING
 		rectw += UpgradeMenu.DEFAULT_BUTTON_SIZE.x if not buttons else max(b.rect.width for b in buttons)
 
 		for button in self.buttons:
+			button.ui_parent = self
 			recth += button.rect.height
 			button.rect.topleft = Vector2(UpgradeMenu.PADDING.x, recth)
 
@@ -536,10 +577,13 @@ class UpgradeMenu(Sprite):
 		rect = FRect(0, 0, 0, 0)
 		return cls(rect, buttons)
 
+	# Is the mouse over the menu or one of its buttons
 	def hovered(self) -> bool:
-		return game.input.mouse_within(self.rect)
+		return game.ui.hot_within(self)
 
+	# The menu is pickable itself, so clicks on its background between buttons do not reach what is underneath
 	def update_move(self):
+		game.ui.submit(self)
 		for button in self.buttons:
 			button.update_move()
 
@@ -549,3 +593,51 @@ class UpgradeMenu(Sprite):
 
 		for button in sorted(self.buttons, key=lambda btn: btn.z):
 			button.update_draw()
+
+
+# Build a Playspace from every building blueprint, with the modules they need added to the game if they are not already
+def test_UNIT_playspace_blueprints():
+	import os
+	import json
+	from gamesystem.mods.defaults import SpritesManager, GameloopManager
+	from gamesystem.mods.window import HeadlessWindowSystem
+	from gamesystem.mods.spatial import SpatialHashModule
+	from gamesystem.mods.assets import AssetManager
+	from gmods import BlueprintsStorageModule, TextureClippingCacheModule, PrerenderCacheModule
+	from turntaking import PlayerTurnTakingModule
+	from tooltip import TooltipManager
+	from ui import UIDispatcher
+	from gamesystem.mods.input import InputManager
+
+	os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+	with open("data/blueprints.json") as file:
+		blueprints = json.load(file)
+	with open("data/assets.json") as file:
+		textures = json.load(file)["textures"]
+
+	modules = [
+		(SpritesManager, {"layers": ["BACKGROUND", "PLAYSPACE", "CARD", "PARTICLE", "FOREGROUND", "UI", "TRANSITION"]}),
+		(SpatialHashModule, {"layers": ["PLAYSPACE", "CARD"]}),
+		(GameloopManager, {}),
+		(HeadlessWindowSystem, {"size": (1280, 720)}),
+		(TooltipManager, {}),
+		(InputManager, {}),
+		(UIDispatcher, {}),
+		(BlueprintsStorageModule, {"blueprints": blueprints}),
+		(AssetManager, {"assets": textures, "preload": False}),
+		(TextureClippingCacheModule, {}),
+		(PrerenderCacheModule, {}),
+		(PlayerTurnTakingModule, {}),
+	]
+	for module, kwargs in modules:
+		if not hasattr(game, module.IDMARKER):
+			game.add_module(module, **kwargs)
+
+	spaces = {}
+	for name, blueprint in game.blueprints.ibuildings():
+		spaces[name] = Playspace.from_blueprint(blueprint)
+		game.sprites.new(spaces[name])
+
+	# Buildings with different textures never share Surfaces, even if their space_id is the same
+	for a, b in itertools.combinations(spaces.values(), 2):
+		assert (a._picture == b._picture) == (a.surface is b.surface)
@@ -1,11 +1,17 @@
 from prelude import *
-from pygame.font import Font
+from gamesystem.mods.modulebase import GameModule
 import fonts
 
 
-# Tooltip class that appears when a target rect is hovered
-class Tooltip(Sprite):
-	LAYER = "UI"
+# Rendered tooltips, keyed by their text and sizes, so identical cards and buildings share one Surface
+tooltip_cache = fonts.RenderCache(budget=4 * 1024 * 1024)
+
+
+# Tooltip that appears when a target rect is hovered
+# Tooltips are lightweight records, not sprites. The TooltipManager hit-tests all of them in one pass per frame and draws the one that is visible.
+# A Tooltip can also be owned by another sprite instead, which then calls its update_move and update_draw itself (see UpgradeButton)
+# Nothing is rendered until the Tooltip is first shown
+class Tooltip:
 	TOOLTIP_WIDTH = 180
 	TITLE_MARGIN = 20
 	PADDING = 15
@@ -16,46 +22,58 @@ class Tooltip(Sprite):
 		text: str,
 		target: FRect,
 		hover_time: int = consts.TOOLTIP_HOVER_TIME,
-		titlefont: Font = fonts.families.roboto.size(24),
-		bodyfont: Font = fonts.families.roboto.size(16),
-		parent: Optional[Any] = None  # If parent is set, the Tooltip will destroy when the parent is destroyed
+		titlesize: int = 24,
+		bodysize: int = 16,
+		parent: Optional[Any] = None  # If parent is set, the Tooltip is removed when the parent is destroyed
 	):
 		self.title = title
 		self.text = text
 		self.target = target
 		self.parent = parent
+		self.titlesize = titlesize
+		self.bodysize = bodysize
+		self.z = 0  # Tooltips of a higher z win when hovered targets overlap
 
-		# Render Tooltip text
-		titlerender = titlefont.render(title, True, palette.TEXT, None, Tooltip.TOOLTIP_WIDTH)
-		textrender = bodyfont.render(text, True, palette.TEXT, None, Tooltip.TOOLTIP_WIDTH)
+		self.rect = FRect(0, 0, Tooltip.TOOLTIP_WIDTH + Tooltip.PADDING * 2, 0)  # Height is known once rendered
+		self._surface = None
 
-		body_start_at = titlerender.get_height() + Tooltip.PADDING + Tooltip.TITLE_MARGIN
+		self._shown = 0
+		self.hover_time = hover_time
+
+		self.invisible = False
 
-		self.rect = FRect(
-			0,  # Default position
+	# Render the Tooltip, or get the Surface of an identical one
+	def surface(self) -> Surface:
+		if self._surface is None:
+			key = (self.title, self.text, self.titlesize, self.bodysize)
+			self._surface = tooltip_cache.get_or_render(key, self._render)
+			self.rect.size = self._surface.get_size()
+		return self._surface
+
+	def _render(self) -> Surface:
+		titlerender = fonts.families.roboto.render(self.title, self.titlesize, True, palette.TEXT, None, Tooltip.TOOLTIP_WIDTH)
+		textrender = fonts.families.roboto.render(self.text, self.bodysize, True, palette.TEXT, None, Tooltip.TOOLTIP_WIDTH)
+
+		body_start_at = titlerender.get_height() + Tooltip.PADDING + Tooltip.TITLE_MARGIN
+		rect = FRect(
+			0,
 			0,
 			Tooltip.TOOLTIP_WIDTH + Tooltip.PADDING * 2,
 			textrender.get_height() + body_start_at + Tooltip.PADDING
 		)
 
-		self._surface = Surface(self.rect.size)
-		self._surface.fill(palette.TOOLTIP)
-
-		self._surface.blit(titlerender, Vector2(Tooltip.PADDING, Tooltip.PADDING))
-		self._surface.blit(textrender, Vector2(Tooltip.PADDING, body_start_at))
-
-		pygame.draw.rect(
-			self._surface, palette.GREY, self.rect.inflate(-Tooltip.PADDING // 2, -Tooltip.PADDING // 2), width=1
-		)
+		surface = Surface(rect.size)
+		surface.fill(palette.TOOLTIP)
 
-		self._shown = 0
-		self.hover_time = hover_time
+		surface.blit(titlerender, Vector2(Tooltip.PADDING, Tooltip.PADDING))
+		surface.blit(textrender, Vector2(Tooltip.PADDING, body_start_at))
 
-		self.invisible = False
+		pygame.draw.rect(surface, palette.GREY, rect.inflate(-Tooltip.PADDING // 2, -Tooltip.PADDING // 2), width=1)
+		return surface
 
-	# Count the number of frames until the Tooltip should be shown
-	def _update_hover(self):
-		if game.input.mouse_within(self.target):
+	# Count the number of frames until the Tooltip should be shown, given whether its target is hovered
+	def hover(self, within: bool):
+		if within:
 			if game.input.mouse.any():
 				self._shown = 0
 
@@ -69,29 +87,107 @@ class Tooltip(Sprite):
 	def visible(self):
 		return self._shown >= self.hover_time and not self.invisible
 
+	def is_orphaned(self) -> bool:
+		return self.parent is not None and self.parent.is_destroyed()
+
 	def _out_of_bounds(self):
 		return self.rect.clamp(game.windowsystem.rect) != self.rect
 
+	# Move next to the mouse, on whichever side keeps the Tooltip on screen
+	def place(self):
+		self.surface()
+		mp = game.input.mouse_pos()
+		self.rect.topleft = mp
+
+		if self._out_of_bounds():
+			self.rect.bottomleft = mp
+
+		if self._out_of_bounds():
+			self.rect.topright = mp
+
+		if self._out_of_bounds():
+			self.rect.bottomright = mp
+
+	# For Tooltips owned by another sprite
 	def update_move(self):
-		self._update_hover()
+		self.hover(game.input.mouse_within(self.target))
+		if self.visible():
+			self.place()
 
+	# Draw if visible
+	def update_draw(self):
 		if self.visible():
-			mp = game.input.mouse_pos()
-			self.rect.topleft = mp
+			game.windowsystem.screen.blit(self.surface(), self.rect.topleft)
 
-			if self._out_of_bounds():
-				self.rect.bottomleft = mp
 
-			if self._out_of_bounds():
-				self.rect.topright = mp
+# Sprite holding the Tooltips of the current scene, and drawing the one that is visible above the rest of the UI
+# Being a sprite, it is purged with the scene along with its Tooltips
+class TooltipLayer(Sprite):
+	LAYER = "UI"
 
-			if self._out_of_bounds():
-				self.rect.bottomright = mp
+	def __init__(self):
+		self.tooltips: List[Tooltip] = []
+		self.active: Optional[Tooltip] = None
+		self.z = 10
 
-		if self.parent and self.parent.is_destroyed():
-			self.destroy()
+	# Find the hovered Tooltip in a single pass, dropping those whose parent has been destroyed
+	def update_move(self):
+		mouse = game.input.mouse_pos()
+		hovered = None
+		keep = []
+		for tooltip in self.tooltips:
+			if tooltip.is_orphaned():
+				continue
+			keep.append(tooltip)
+
+			# Later Tooltips win ties, as their targets were created later and are drawn on top
+			if tooltip.target.collidepoint(mouse) and (hovered is None or tooltip.z >= hovered.z):
+				hovered = tooltip
+		self.tooltips = keep
+
+		if self.active is not None and self.active is not hovered:
+			self.active.hover(False)
+		self.active = hovered
+
+		if hovered is not None:
+			hovered.hover(True)
+			if hovered.visible():
+				hovered.place()
 
-	# Draw if visible
 	def update_draw(self):
-		if self.visible():
-			game.windowsystem.screen.blit(self._surface, self.rect.topleft)
+		if self.active is not None:
+			self.active.update_draw()
+
+	def draw_state(self):
+		if self.active is None or not self.active.visible():
+			return ((0, 0, 0, 0), None)
+		return (self.active.rect, id(self.active))
+
+
+# Module that keeps track of every free-standing Tooltip
+class TooltipManager(GameModule):
+	IDMARKER = "tooltips"
+	REQUIREMENTS = ["sprites"]
+
+	def create(self):
+		self._layer = None
+
+	# The current scene's TooltipLayer, creating it if the last one was purged
+	def _current_layer(self) -> TooltipLayer:
+		if self._layer is None or self._layer.is_destroyed():
+			self._layer = TooltipLayer()
+			game.sprites.new(self._layer)
+		return self._layer
+
+	def add(self, tooltip: Tooltip) -> Tooltip:
+		self._current_layer().tooltips.append(tooltip)
+		return tooltip
+
+	def new(self, *args, **kwargs) -> Tooltip:
+		return self.add(Tooltip(*args, **kwargs))
+
+	# The Tooltip that is currently shown, if any
+	def visible(self) -> Optional[Tooltip]:
+		if self._layer is None or self._layer.active is None or not self._layer.active.visible():
+			return None
+		return self._layer.active
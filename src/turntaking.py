@@ -40,14 +40,13 @@ class GameComplete(Sprite):
 	ANIM_TIMING = 50
 
 	def __init__(self, rect: FRect, victory: bool, disable_callback: Optional[Callable] = None):
-		self.surface = Surface(rect.size)
+		self.surface = Surface(rect.size, pygame.SRCALPHA)  # Per-pixel alpha, so it blends over the retained UI layer's composite
 		self.surface.fill(palette.BLACK)
 		self.surface.set_alpha(GameComplete.ANIM_TIMING)
 
 		# Message to display
 		self.message = "You win!" if victory else "You lose!"
-		self._font = fonts.families.roboto.size(70)
-		self._render = self._font.render(self.message, True, palette.TEXT)
+		self._render = fonts.families.roboto.render(self.message, 70, True, palette.TEXT)
 		self._font_easing = EasingVector2(Vector2(game.windowsystem.dimensions.x/2, -200), Vector2(game.windowsystem.dimensions / 2), duration = GameComplete.ANIM_TIMING)
 		self._font_pos = self._font_easing(0)
 
@@ -92,7 +91,7 @@ class GameComplete(Sprite):
 						logging.error(f"Request failed with {e} error")
 
 					# Creates a text label based on whether the submission was successful or not
-					res_text = fonts.families.roboto.size(45).render(text, True, palette.TEXT)
+					res_text = fonts.families.roboto.render(text, 45, True, palette.TEXT)
 					padding = Vector2(20, 20)
 					bg = Surface(res_text.get_size() + padding)
 					bg.fill(palette.BLACK)
@@ -134,13 +133,17 @@ class GameComplete(Sprite):
 				# Render game statistics
 				tpos = Vector2(20, 20)
 				for text in stats:
-					render = fonts.families.roboto.size(18).render(text, True, palette.TEXT)
+					render = fonts.families.roboto.render(text, 18, True, palette.TEXT)
 					stats_render.blit(render, tpos)
 					tpos.y += 30
 
 				game.sprites.new(ImageSprite(submit_btn.rect.topright + Vector2(40, 0), stats_render), layer_override="UI")
 
 
+	# Static once the text has finished moving into place
+	def draw_state(self):
+		return (self.surface.get_rect(), min(self._frames, GameComplete.ANIM_TIMING*2))
+
 	def update_draw(self):
 		self.surface.set_alpha(min(self._frames, GameComplete.ANIM_TIMING)*4)
 		game.windowsystem.screen.blit(self.surface, VZERO)
@@ -290,11 +293,11 @@ class PlayerTurnTakingModule(GameModule):
 
 		self.transitioning = True
 
-		timer = PlayerTurnTakingModule.TURN_TRANSITION_LENGTH if list(game.sprites.get("CARD")) else 10
+		timer = PlayerTurnTakingModule.TURN_TRANSITION_LENGTH if game.sprites.get("CARD") else 10
 		tick = TickCoroutine(timer, self.next_turn)
 		game.sprites.new(tick, layer_override="MANAGER")
 
-		cards = game.sprites.get("CARD")
+		cards = list(game.sprites.get("CARD"))
 		random.shuffle(cards)
 
 		def pollute():
@@ -1,18 +1,21 @@
 from prelude import *
+from gamesystem.mods.modulebase import GameModule
 import fonts
 from gameutil import surface_rounded_corners
-from tooltip import Tooltip
 from particles import DeflatingParticle
+from easing_functions import CubicEaseInOut
 
 Onclick = Optional[Callable]
 
 
 # Base class that all buttons inherit from
+# Buttons do not hit-test the mouse themselves. They submit themselves to the UIDispatcher every update, which works out the one widget under the mouse
 class AbstractButton(Sprite):
 	def __init__(self, rect: FRect, onclick: Onclick = None):
 		self.rect = rect
 		self.onclick = onclick
 		self.disabled = False
+		self.ui_parent = None  # Widget or sprite that updates and draws this one, if it is not a sprite in its own right
 
 	# Set the function that will run when the button is clicked
 	def set_onclick(self, onclick: Optional[Callable]):
@@ -23,9 +26,9 @@ class AbstractButton(Sprite):
 		self.rect.topleft = pos  # type: ignore
 		return self
 
-	# Is the button currently being hovered by the mouse
+	# Is the button currently being hovered by the mouse, and not covered by another widget
 	def hovered(self) -> bool:
-		return game.input.mouse_within(self.rect) and not self.disabled
+		return game.ui.hot is self and not self.disabled
 
 	# Is the mouse hovering the button and pressed down
 	def mouse_down_over(self, mbtn=0) -> bool:
@@ -39,15 +42,23 @@ class AbstractButton(Sprite):
 	def unclicked(self, mbtn=0) -> bool:
 		return not self.hovered() and game.input.mouse_pressed(mbtn)
 
-	# Check if clicked and run methods if so
-	def update_move(self):
-		if self.clicked() and self.onclick:
+	# Run when the UIDispatcher delivers a click to the button
+	def click(self):
+		if self.hovered() and self.onclick:
 			self.onclick()
 			game.audio.sounds.button.play()
 
+	# Stay pickable for the next update
+	def update_move(self):
+		game.ui.submit(self)
+
 	def update_draw(self):
 		pygame.draw.rect(game.windowsystem.screen, palette.ERROR, self.rect)
 
+	# Buttons only look different when hovered, pressed or disabled
+	def draw_state(self):
+		return (self.rect, (self.hovered(), self.mouse_down_over(), self.disabled))
+
 
 # Button that renders a Surface
 class SurfaceButton(AbstractButton):
@@ -74,8 +85,8 @@ class NamedButton(AbstractButton):
 		super().__init__(rect, onclick)
 		self.c = colour
 		self._text = text
-		self._font = fonts.families.roboto.size(int(self.rect.height / 4))
-		self._rendered = self._font.render(self._text, True, palette.TEXT)  # Render the text label
+		self._font_size = int(self.rect.height / 4)
+		self._rendered = fonts.families.roboto.render(self._text, self._font_size, True, palette.TEXT)  # Render the text label
 
 	# Draw the button background and render text on top
 	def update_draw(self):
@@ -94,34 +105,49 @@ class NamedButton(AbstractButton):
 
 
 # Progress bar from 0 to 100 with a label
+# The frame, label and empty track never change, so they are rendered once. Each frame only the filled part of the track is drawn over them,
+# and the fill eases towards the ratio over FILL_TWEEN_TICKS instead of jumping
 class ProgressBar(Sprite):
 	LAYER = "UI"
 	SIDE_PADDING = 10
+	FILL_TWEEN_TICKS = 20
 
 	def __init__(self, rect: FRect, text: str, colour: Color = palette.BLACK):
 		self.rect = rect
 		self._text = text
 		self.c = colour
 		self.ratio = 0.0
-		self._font = fonts.families.roboto.size(int(self.rect.height // 2))
-		self._label = self._font.render(self._text, True, palette.TEXT)
+		self.alpha = 255
+		self._shown_ratio = 0.0  # Ratio the fill is currently drawn at
+		self._tween = None
+		self._tween_tick = 0
+		self._label = fonts.families.roboto.render(self._text, int(self.rect.height // 2), True, palette.TEXT)
 
-		self._bar = Surface(self.rect.size, pygame.SRCALPHA)
 		self.rerender()
 
 	def with_tooltip(self, text: str):
-		game.sprites.new(Tooltip(self._text, text, self.rect))
+		game.tooltips.new(self._text, text, self.rect)
 		return self
 
-	# Set the percentage filled
+	# Set the percentage filled. The fill eases to it, unless rerender is set, in which case it is drawn filled to it straight away
 	def set_ratio(self, ratio: float, rerender: bool = False):
-		self.ratio = max(0.0, min(ratio, 1.0))
+		ratio = max(0.0, min(ratio, 1.0))
 		if rerender:
-			self.rerender()
+			self.ratio = self._shown_ratio = ratio
+			self._tween = None
+		elif ratio != self.ratio:
+			self.ratio = ratio
+			self._tween = CubicEaseInOut(self._shown_ratio, ratio, ProgressBar.FILL_TWEEN_TICKS)
+			self._tween_tick = 0
 		return self
 
+	# Set the opacity of the whole bar
+	def set_alpha(self, alpha: int):
+		self.alpha = alpha
+
+	# Render the frame, label and empty track, and the Surface the filled part of the track is drawn from
 	def rerender(self):
-		self._bar.set_alpha(255)
+		self._bar = Surface(self.rect.size, pygame.SRCALPHA)
 		self._bar.fill(self.c)
 		self._bar.blit( self._label, (ProgressBar.SIDE_PADDING, self._bar.get_height()/2 - self._label.get_height() / 2))
 
@@ -132,47 +158,90 @@ class ProgressBar(Sprite):
 		end = bw - ProgressBar.SIDE_PADDING
 		length = end - start
 
-		barbg = FRect(start, ProgressBar.SIDE_PADDING, length, self.rect.height - ProgressBar.SIDE_PADDING*2)
-		barfg = barbg.copy()
-		barfg.width = barbg.width * self.ratio
-		pygame.draw.rect(self._bar, palette.GREY, barbg)
-		pygame.draw.rect(self._bar, palette.WHITE, barfg)
+		self._track = FRect(start, ProgressBar.SIDE_PADDING, length, self.rect.height - ProgressBar.SIDE_PADDING*2)
+		pygame.draw.rect(self._bar, palette.GREY, self._track)
 
 		self._bar = surface_rounded_corners(self._bar, 5)
 
+		# The track is well inside the rounded corners, so the fill does not need them
+		self._fill = Surface(self._track.size)
+		self._fill.fill(palette.WHITE)
+
+		# The bar put together at the last fill width and alpha it was drawn translucent at
+		self._translucent = Surface(self.rect.size, pygame.SRCALPHA)
+		self._translucent_key = None
+
+	def update_move(self):
+		if self._tween is not None:
+			self._tween_tick += 1
+			self._shown_ratio = self._tween(self._tween_tick)
+			if self._tween_tick >= ProgressBar.FILL_TWEEN_TICKS:
+				self._shown_ratio = self.ratio
+				self._tween = None
+
+	# Width in pixels of the filled part of the track. Truncated, as drawing an FRect of this width would be
+	def _fill_width(self) -> int:
+		return int(self._track.width * self._shown_ratio)
+
+	def _draw_to(self, surface: Surface, pos):
+		surface.blit(self._bar, pos)
+
+		width = self._fill_width()
+		if width > 0:
+			surface.blit(self._fill, self._track.move(pos).topleft, Rect(0, 0, width, self._fill.get_height()))
+
+	# A translucent bar is put together first and blended onto the screen in one blit, which keeps it correct on a retained layer's composite
+	# It is only put together again when the fill width or the alpha changes
 	def update_draw(self):
-		game.windowsystem.screen.blit(self._bar, self.rect.topleft)
+		if self.alpha == 255:
+			self._draw_to(game.windowsystem.screen, self.rect.topleft)
+			return
+
+		key = (self._fill_width(), self.alpha)
+		if key != self._translucent_key:
+			self._translucent.fill((0, 0, 0, 0))
+			self._draw_to(self._translucent, (0, 0))
+			self._translucent.set_alpha(self.alpha)
+			self._translucent_key = key
+		game.windowsystem.screen.blit(self._translucent, self.rect.topleft)
+
+	def draw_state(self):
+		return (self.rect, (self._shown_ratio, self.alpha))
 
 
 
 # ProgressBar that watches a specific stat in the PlayerStateTrackingModule, and updates when that state updates
+# A DeflatingParticle marks each change, but only one is shown at a time, so quick runs of changes are marked once
 class TargettingProgressBar(ProgressBar):
 	def __init__(self, *args, target=None, **kwargs):
 		super().__init__(*args, **kwargs)
 		self._target = target
 		self._og_rect = self.rect.copy()
+		self._change_particle = None
 
 	def do_targeting(self):
-		value = game.playerstate.get_property(self._target)
+		# Compare as set_ratio would store it, as the property can go past the ends of the bar
+		value = max(0.0, min(game.playerstate.get_property(self._target), 1.0))
 		if self.ratio != value:
 			self.set_ratio(value)
-			self.rerender()
-			game.sprites.new(DeflatingParticle(self.rect.inflate(20, 20), palette.GREY, 60))
+			if self._change_particle is None or self._change_particle.is_destroyed():
+				self._change_particle = DeflatingParticle(self.rect.inflate(20, 20), palette.GREY, 60)
+				game.sprites.new(self._change_particle)
 
 	def update_move(self):
 		if self._target is not None:
 			self.do_targeting()
+		super().update_move()
 
 
 # TargettingProgressBar that becomes transparent when a Playspace is under it
 class DodgingProgressBar(TargettingProgressBar):
-	def update_draw(self):
-		if any(space.rect.colliderect(self.rect) for space in game.sprites.get("PLAYSPACE")):
-			self._bar.set_alpha(100)
-		else:
-			self._bar.set_alpha(255)
+	def update_move(self):
+		super().update_move()
 
-		super().update_draw()
+		alpha = 100 if game.spatial.any("PLAYSPACE", self.rect) else 255
+		if alpha != self.alpha:
+			self.set_alpha(alpha)
 
 
 # UNUSED
@@ -184,7 +253,6 @@ class UserDebugLog(Sprite):
 		self.rect = rect
 		self.num_lines = num_lines
 		self.text_size = text_size
-		self._font = fonts.families.roboto.size(text_size)
 		self._queue = []
 
 		self.colour = colour
@@ -209,7 +277,7 @@ class UserDebugLog(Sprite):
 		rect.inflate_ip(-20, -20)
 		rect.height = self.text_size
 		for text in itertools.islice(self._queue, self.num_lines):
-			render = self._font.render(text, True, palette.TEXT)
+			render = fonts.families.roboto.render(text, self.text_size, True, palette.TEXT)
 			game.windowsystem.screen.blit(render, rect)
 			rect.y += rect.height * 1.2
 
@@ -223,6 +291,8 @@ class Dropdown(AbstractButton):
 
 		self.elements = elements
 		self._dropped = False
+		if self.elements:
+			self.elements.ui_parent = self
 
 	def toggle(self):
 		self._dropped = not self._dropped
@@ -236,7 +306,11 @@ class Dropdown(AbstractButton):
 
 	# If mouse clicks elsewhere, toggle off
 	def unclicked(self, mbtn=0) -> bool:
-		return not self.hovered() and (not self.elements.hovered() if self.elements else True) and game.input.mouse_pressed(mbtn)
+		return not game.ui.hot_within(self) and game.input.mouse_pressed(mbtn)
+
+	# The dropped elements can change in ways the Dropdown cannot see, so redraw everything while they are shown
+	def draw_state(self):
+		return None if self._dropped else super().draw_state()
 
 	def update_move(self):
 		super().update_move()
@@ -269,3 +343,63 @@ class Dropdown(AbstractButton):
 
 		if self._dropped and self.elements:
 			self.elements.update_draw()
+
+
+# Module that finds the one widget under the mouse each tick, and delivers clicks to it
+# Widgets submit themselves from their update_move, and the next tick's pick pass only considers those, so a widget that stops being updated
+# (e.g. the buttons of a closed Dropdown) can no longer be hovered or clicked.
+# The topmost widget wins, in the order they are drawn: by the layer and z of the sprite that draws them, then by the order they were submitted in,
+# as widgets drawn by a parent are updated after it. Widgets underneath the topmost one see neither the hover nor the click
+class UIDispatcher(GameModule):
+	IDMARKER = "ui"
+	REQUIREMENTS = ["sprites", "input"]
+
+	def create(self):
+		self.hot = None  # Topmost widget under the mouse
+		self._widgets = []  # Widgets submitted during the last tick
+		self._submitted = []  # Widgets submitted during this tick
+
+	# Make a widget pickable on the next tick. Widgets need a rect, and a click method if they can be clicked
+	def submit(self, widget):
+		self._submitted.append(widget)
+
+	# Is the hot widget this widget, or one updated and drawn by it
+	def hot_within(self, widget) -> bool:
+		hot = self.hot
+		while hot is not None:
+			if hot is widget:
+				return True
+			hot = getattr(hot, "ui_parent", None)
+		return False
+
+	# The sprite that draws a widget, which is the widget itself unless it belongs to a parent
+	@staticmethod
+	def _root(widget):
+		while getattr(widget, "ui_parent", None) is not None:
+			widget = widget.ui_parent
+		return widget
+
+	# Pick the topmost widget under the mouse, and click it if the mouse was just pressed
+	def update(self):
+		self._widgets, self._submitted = self._submitted, []
+
+		mouse = self.game.input.mouse_pos()
+		hits = [(i, widget) for i, widget in enumerate(self._widgets) if widget.rect.collidepoint(mouse)]
+		if not hits:
+			self.hot = None
+			return
+
+		ranks = {id(self.game.sprites.get_layer(name)): rank for rank, name in enumerate(self.game.sprites.layer_names())}
+		best = None
+		for i, widget in hits:
+			root = self._root(widget)
+			if root.is_destroyed():
+				continue
+
+			key = (ranks.get(id(root._layer), -1), root.z, i)
+			if best is None or key > best[0]:
+				best = (key, widget)
+
+		self.hot = None if best is None else best[1]
+		if self.hot is not None and self.game.input.mouse_pressed(0) and hasattr(self.hot, "click"):
+			self.hot.click()